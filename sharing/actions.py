@@ -0,0 +1,58 @@
+"""
+Admin actions limiting selected objects to those the requesting user has been
+granted permission for, resolved in a single query.
+"""
+from __future__ import with_statement
+
+from django.contrib.admin import actions
+from django.contrib.admin.util import model_ngettext
+
+from sharing import utils
+from sharing.models import deferred_share_cleanup
+
+def limit_selected(modeladmin, request, queryset, perm):
+    """
+    Returns the given selected objects limited to those the requesting user
+    has the given permission for, i.e. 'change' or 'delete', notifying the
+    user of skipped objects.
+    """
+    limited = utils.limit_queryset_by_permission(
+        qs=queryset,
+        perm=modeladmin.opts.app_label + '.' + perm,
+        user=request.user,
+    )
+    skipped = queryset.count() - limited.count()
+    if skipped:
+        modeladmin.message_user(request, "Skipped %d %s you do not have permission to %s." % (
+            skipped, model_ngettext(modeladmin.opts, skipped), perm,
+        ))
+    return limited
+
+def delete_selected(modeladmin, request, queryset):
+    """
+    Deletes the selected objects the requesting user may delete, skipping the
+    rest. Shares of deleted objects, including objects deleted through
+    cascades, are deleted in bulk once all objects are deleted.
+    """
+    # Skipped objects are reported on the confirmation page, which only posts
+    # back the objects the user may delete.
+    queryset = limit_selected(modeladmin, request, queryset, 'delete')
+    with deferred_share_cleanup():
+        return actions.delete_selected(modeladmin, request, queryset)
+delete_selected.short_description = actions.delete_selected.short_description
+
+def share_with_group(group, can_view=True, can_change=False, can_delete=False):
+    """
+    Returns an action sharing the selected objects the requesting user may
+    change with the given group.
+    """
+    def action(modeladmin, request, queryset):
+        objs = list(limit_selected(modeladmin, request, queryset, 'change'))
+        utils.grant_shares([(group, obj) for obj in objs], can_view, can_change, can_delete)
+        count = len(objs)
+        modeladmin.message_user(request, "Shared %d %s with %s." % (
+            count, model_ngettext(modeladmin.opts, count), group,
+        ))
+    action.__name__ = 'share_with_group_%s' % group.pk
+    action.short_description = "Share selected %%(verbose_name_plural)s with %s" % group
+    return action
@@ -1,25 +1,112 @@
+import inspect
+
+from django import forms
 from django.contrib import admin
-from django.contrib.admin import widgets
+from django.contrib.auth.models import User
 from django.contrib.contenttypes import generic
-from django.contrib.contenttypes.models import ContentType
 
-from sharing import utils
-from sharing.models import GroupShare, UserShare
+from sharing import actions, registry, utils
+from sharing.filters import get_share_changelist_class
+from sharing.query import CachedCountQuerySet
+from sharing.models import SCOPE_CHOICES, GroupShare, ScopeShare, UserShare, get_object_field, get_object_key
+from sharing.registry import get_content_type
 
-class GroupShareInline(generic.GenericTabularInline):
+class ShareInlineFormSet(generic.BaseGenericInlineFormSet):
     """
-    Group share inline admin class.
+    Share inline formset preventing more than one share per principal, as 
+    enforced by the share models' unique constraints.
+    """
+    principal_field = None
+
+    def clean(self):
+        super(ShareInlineFormSet, self).clean()
+        if any(self.errors):
+            return
+
+        principals = []
+        for form in self.forms:
+            if not getattr(form, 'cleaned_data', None) or form.cleaned_data.get('DELETE'):
+                continue
+            principal = form.cleaned_data.get(self.principal_field)
+            if principal is None:
+                continue
+            if principal in principals:
+                raise forms.ValidationError("%s can only be shared with once." % principal)
+            principals.append(principal)
+
+class GroupShareInlineFormSet(ShareInlineFormSet):
+    principal_field = 'group'
+
+class ScopeShareInlineFormSet(ShareInlineFormSet):
+    principal_field = 'scope'
+
+class UserShareInlineFormSet(ShareInlineFormSet):
+    principal_field = 'user'
+
+class ShareInline(generic.GenericTabularInline):
     """
+    Share inline admin class loading principals along with shares and their
+    choices once per formset instead of once per form.
+    """
+    exclude = ['object_pk', 'permissions']
     extra = 1
+
+    def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
+        field = super(ShareInline, self).formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == self.formset.principal_field and db_field.name not in self.raw_id_fields:
+            # Forms copy evaluated choices rather than querying them each.
+            field.choices = list(field.choices)
+        return field
+
+    def queryset(self, request):
+        qs = super(ShareInline, self).queryset(request)
+        if self.model._meta.get_field(self.formset.principal_field).rel:
+            qs = qs.select_related(self.formset.principal_field)
+        return qs
+
+class GroupShareInline(ShareInline):
+    """
+    Group share inline admin class.
+    """
+    formset = GroupShareInlineFormSet
     model = GroupShare
 
-class UserShareInline(generic.GenericTabularInline):
+class ScopeShareInline(ShareInline):
+    """
+    Scope share inline admin class.
+    """
+    extra = 0
+    formset = ScopeShareInlineFormSet
+    model = ScopeShare
+
+class UserShareInline(ShareInline):
     """
     User share inline admin class.
     """
-    extra = 1
+    formset = UserShareInlineFormSet
     model = UserShare
 
+class GroupSharePkInline(GroupShareInline):
+    """
+    Group share inline admin class for models with non-integer primary keys.
+    """
+    ct_fk_field = 'object_pk'
+    exclude = ['object_id', 'permissions']
+
+class ScopeSharePkInline(ScopeShareInline):
+    """
+    Scope share inline admin class for models with non-integer primary keys.
+    """
+    ct_fk_field = 'object_pk'
+    exclude = ['object_id', 'permissions']
+
+class UserSharePkInline(UserShareInline):
+    """
+    User share inline admin class for models with non-integer primary keys.
+    """
+    ct_fk_field = 'object_pk'
+    exclude = ['object_id', 'permissions']
+
 class ShareAdminMixin(object):
     """
     Admin class limiting admin content access based on object and user permissions and 
@@ -28,55 +115,107 @@ class ShareAdminMixin(object):
     inlines = [
         GroupShareInline,
         UserShareInline,
+        ScopeShareInline,
     ]
 
+    # Seconds to cache changelist counts for, None to always count.
+    share_count_cache_timeout = None
+
+    # Whether or not to provide actions sharing selected objects with each of
+    # the requesting user's groups.
+    share_group_actions = True
+
+    # Whether or not to filter changelists by how objects are shared with the
+    # requesting user.
+    share_source_filter = True
+
+    # Name of a field referencing the user owning objects, for the changelist
+    # owned by me filter. Full user shares determine owners if None.
+    share_owner_field = None
+
+    def __init__(self, model, admin_site):
+        # Shares of models with non-integer primary keys store them in object_pk.
+        if get_object_field(model) == 'object_pk':
+            pk_inlines = {
+                GroupShareInline: GroupSharePkInline,
+                ScopeShareInline: ScopeSharePkInline,
+                UserShareInline: UserSharePkInline,
+            }
+            self.inlines = [pk_inlines.get(inline, inline) for inline in self.inlines]
+        super(ShareAdminMixin, self).__init__(model, admin_site)
+
     def formfield_for_foreignkey(self, db_field, request=None, **kwargs):
         """
-        Get a form Field for a ForeignKey.
-        """
-        db = kwargs.get('using')
-        if db_field.name in self.raw_id_fields:
-            kwargs['widget'] = widgets.ForeignKeyRawIdWidget(db_field.rel, using=db)
-        elif db_field.name in self.radio_fields:
-            kwargs['widget'] = widgets.AdminRadioSelect(attrs={
-                'class': get_ul_class(self.radio_fields[db_field.name]),
-            })
-            kwargs['empty_label'] = db_field.blank and _('None') or None
-       
-        # Limit queryset by permissions.
-        kwargs['queryset'] = utils.limit_queryset_by_permission(
-            qs=db_field.rel.to.objects.all(), 
-            perm=self.opts.app_label + '.view', 
-            user=request.user,
-        )
-
-        return db_field.formfield(**kwargs)
+        Get a form Field for a ForeignKey, limited to objects the requesting 
+        user may view.
+        """
+        kwargs['queryset'] = self.limit_related_queryset(db_field, request, kwargs.get('using'))
+        return super(ShareAdminMixin, self).formfield_for_foreignkey(db_field, request, **kwargs)
     
     def formfield_for_manytomany(self, db_field, request=None, **kwargs):
         """
-        Get a form Field for a ManyToManyField.
+        Get a form Field for a ManyToManyField, limited to objects the 
+        requesting user may view.
         """
-        # If it uses an intermediary model that isn't auto created, don't show
-        # a field in admin.
-        if not db_field.rel.through._meta.auto_created:
-            return None
-        db = kwargs.get('using')
-    
-        if db_field.name in self.raw_id_fields:
-            kwargs['widget'] = widgets.ManyToManyRawIdWidget(db_field.rel, using=db)
-            kwargs['help_text'] = ''
-        elif db_field.name in (list(self.filter_vertical) + list(self.filter_horizontal)):
-            kwargs['widget'] = widgets.FilteredSelectMultiple(db_field.verbose_name, (db_field.name in self.filter_vertical))
-   
-        # Limit queryset by permissions.
-        kwargs['queryset'] = utils.limit_queryset_by_permission(
-            qs=db_field.rel.to.objects.all(), 
-            perm=self.opts.app_label + '.view', 
+        kwargs['queryset'] = self.limit_related_queryset(db_field, request, kwargs.get('using'))
+        return super(ShareAdminMixin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
+    def limit_related_queryset(self, db_field, request, using=None):
+        """
+        Returns a queryset of objects the requesting user may view for the 
+        given relation field. The queryset is lazy, so it only hits the 
+        database once choices are rendered or submitted values validated, in 
+        which case raw id fields only query the submitted ids.
+        """
+        qs = db_field.rel.to._default_manager.using(using).complex_filter(db_field.rel.limit_choices_to)
+        return utils.limit_queryset_by_permission(
+            qs=qs, 
+            perm=db_field.rel.to._meta.app_label + '.view', 
             user=request.user,
         )
-
-        return db_field.formfield(**kwargs)
     
+    def get_actions(self, request):
+        """
+        Returns actions limited to selected objects the requesting user has
+        been granted permission for, including actions sharing them with each 
+        of the requesting user's groups.
+        """
+        share_actions = super(ShareAdminMixin, self).get_actions(request)
+        if 'delete_selected' in share_actions:
+            share_actions['delete_selected'] = (actions.delete_selected, 'delete_selected', 
+                    share_actions['delete_selected'][2])
+        # Empty actions are disabled, i.e. in popups.
+        if share_actions and self.share_group_actions:
+            for group in request.user.groups.all():
+                action = actions.share_with_group(group)
+                share_actions[action.__name__] = (action, action.__name__, action.short_description)
+        return share_actions
+
+    def get_changelist(self, request, **kwargs):
+        """
+        Returns the ChangeList class applying share source filters, based on
+        the ChangeList class of the admin class the mixin is applied to.
+        """
+        return get_share_changelist_class(super(ShareAdminMixin, self).get_changelist(request, **kwargs))
+
+    def share_sources(self, obj):
+        """
+        Changelist column listing the requesting user, her groups and scopes
+        directly sharing the object with her, resolved for all listed objects 
+        at once. Add 'share_sources' to list_display to enable it.
+        """
+        scopes = dict(SCOPE_CHOICES)
+        labels = []
+        for principal in getattr(obj, '_share_principals', ()):
+            if isinstance(principal, basestring):
+                labels.append(scopes[principal])
+            elif isinstance(principal, User):
+                labels.append('Me')
+            else:
+                labels.append(unicode(principal))
+        return ', '.join(labels)
+    share_sources.short_description = 'Shared through'
+
     def has_change_permission(self, request, obj=None):
         """
         Returns True if the given request has permission to change the given
@@ -110,7 +249,12 @@ class ShareAdminMixin(object):
         if ordering:
             qs = qs.order_by(*ordering)
 
-        # Filter objects based on can_view permission.
+        # Cache counts if configured.
+        if self.share_count_cache_timeout:
+            qs = qs._clone(klass=CachedCountQuerySet, count_timeout=self.share_count_cache_timeout)
+
+        # Filter objects based on can_view permission, as a subquery so counts
+        # and pages are resolved by the database.
         # Superusers can view all objects.
         if request.user.is_superuser:
             return qs
@@ -123,23 +267,68 @@ class ShareAdminMixin(object):
     
     def save_model(self, request, obj, form, change):
         """
-        On admin save create full share for requesting user.
+        On admin save create full share for requesting user, unless she holds 
+        a valid share already.
         """
         super(ShareAdminMixin, self).save_model(request, obj, form, change)
         
-        # Setup full share if it does not already exist.
+        # Setup full share unless a valid share already exists, replacing 
+        # shares outside of their window as these grant nothing.
+        lookup = {
+            'user': request.user,
+            'content_type': get_content_type(obj),
+            get_object_field(obj.__class__): get_object_key(obj),
+        }
         try:
-            UserShare.objects.get(
-                user=request.user,
-                content_type=ContentType.objects.get_for_model(obj),
-                object_id=obj.id,
-            )
+            share = UserShare.objects.get(**lookup)
+            if share.is_valid():
+                return
         except UserShare.DoesNotExist:
-            UserShare.objects.create(
-                user=request.user,
-                can_view=True,
-                can_change=True,
-                can_delete=True,
-                content_type=ContentType.objects.get_for_model(obj),
-                object_id=obj.id,
-            )
+            share = UserShare(**lookup)
+        share.can_view = share.can_change = share.can_delete = True
+        share.permissions = registry.get_verb_mask(obj.__class__)
+        share.valid_from = share.valid_until = None
+        share.save()
+
+# Maps admin classes to their subclasses applying ShareAdminMixin.
+_share_admin_classes = {}
+
+def get_share_admin_class(admin_class):
+    """
+    Returns a subclass of the given admin class applying ShareAdminMixin, 
+    created once per admin class, or the admin class itself if it already 
+    applies the mixin.
+    """
+    if ShareAdminMixin in inspect.getmro(admin_class):
+        return admin_class
+    try:
+        return _share_admin_classes[admin_class]
+    except KeyError:
+        share_admin_class = _share_admin_classes[admin_class] = type(
+            "%sShareMixin" % admin_class.__name__, 
+            (ShareAdminMixin, admin_class,), 
+            {'inlines': list(admin_class.inlines) + ShareAdminMixin.inlines},
+        )
+        return share_admin_class
+
+class ShareAdminSite(admin.AdminSite):
+    """
+    Admin site applying ShareAdminMixin to admin classes as models are
+    registered, so sharing applies to models registered at any time without
+    rebuilding registered admin classes. Sharing applies to all models by 
+    default, or only to models registered with share=True if share_all is 
+    False.
+    """
+    share_all = True
+
+    def __init__(self, name=None, app_name='admin', share_all=None):
+        super(ShareAdminSite, self).__init__(name, app_name)
+        if share_all is not None:
+            self.share_all = share_all
+
+    def register(self, model_or_iterable, admin_class=None, share=None, **options):
+        if share is None:
+            share = self.share_all
+        if share:
+            admin_class = get_share_admin_class(admin_class or admin.ModelAdmin)
+        super(ShareAdminSite, self).register(model_or_iterable, admin_class, **options)
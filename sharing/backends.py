@@ -1,6 +1,12 @@
-from django.contrib.contenttypes.models import ContentType
+import operator
+from datetime import datetime
+from functools import reduce
 
-from sharing.models import GroupShare,  UserShare
+from sharing import cache, effective, registry, stats
+from sharing.models import EffectiveShare, GroupShare, ScopeShare, UserShare, \
+        get_content_type_object_field, get_object_key, get_scopes, get_unexpired_lookup
+from sharing.registry import get_content_type, get_share_field
+from sharing.utils import SHARE_FIELDS, get_inherited_lookups
 
 class SharingBackend(object):
     """
@@ -17,46 +23,196 @@ class SharingBackend(object):
         """
         return None
 
+    def get_cache(self, user_obj):
+        """
+        Returns the share cache dict of the given user object, discarding it
+        if shares or group memberships changed since it was built.
+        """
+        if getattr(user_obj, '_share_cache_generation', None) != cache.generation:
+            user_obj._share_cache = {}
+            user_obj._share_cache_generation = cache.generation
+        return user_obj._share_cache
+
+    def is_cached(self, user_obj, content_type):
+        """
+        Returns whether or not the given user's shares for the given content 
+        type are cached on the user object.
+        """
+        entry = self.get_cache(user_obj).get(content_type.id)
+        return entry is not None and not cache.is_expired(entry[1])
+
+    def get_shares(self, user_obj, content_type):
+        """
+        Returns a dict mapping primary keys of objects of the given content 
+        type, as returned by get_object_key, to the set of share fields and 
+        custom verbs granted to the given user or her groups.
+
+        All of the user's shares for the content type are loaded at once and
+        cached on the user object, so subsequent checks are dict lookups. The 
+        cache is discarded whenever shares or group memberships change, or once
+        any of the shares become valid or expire. With the SHARING_CACHE 
+        setting enabled loaded shares are also stored in Django's cache, shared
+        between processes.
+        """
+        return self.get_share_entry(user_obj, content_type)[0]
+
+    def get_share_entry(self, user_obj, content_type):
+        """
+        Returns a (shares, expires) tuple of the given user's shares for the
+        given content type as returned by get_shares and the time they need to
+        be reloaded at, None if never.
+        """
+        user_cache = self.get_cache(user_obj)
+        entry = user_cache.get(content_type.id)
+        if entry is None or cache.is_expired(entry[1]):
+            if cache.is_enabled():
+                entry = cache.get_shares(user_obj, content_type, 
+                        lambda: self.load_shares(user_obj, content_type))
+            else:
+                entry = self.load_shares(user_obj, content_type)
+            user_cache[content_type.id] = entry
+        return entry
+
+    def get_inherited(self, user_obj, field, objs):
+        """
+        Returns the set of primary keys of the given objects, all of the same
+        model, inheriting the given share field from ancestors shared with the
+        given user or her groups. Ancestors are resolved in a single query, 
+        with results cached on the user object until ancestor shares become 
+        valid or expire.
+        """
+        if not objs:
+            return set()
+        model = objs[0].__class__
+        lookups = get_inherited_lookups(model, user_obj, field)
+        if not lookups:
+            return set()
+
+        user_cache = self.get_cache(user_obj)
+        key = ('inherited', get_content_type(model).id, field)
+        if key not in user_cache or cache.is_expired(user_cache[key][1]):
+            expiries = [self.get_share_entry(user_obj, get_content_type(ancestor_model))[1] \
+                    for path, ancestor_model in registry.get_ancestor_paths(model)]
+            expiries = [expires for expires in expiries if expires is not None]
+            user_cache[key] = ({}, expiries and min(expiries) or None)
+        inherited = user_cache[key][0]
+
+        missing = [obj.pk for obj in objs if obj.pk not in inherited]
+        if missing:
+            found = set(model._base_manager.filter(pk__in=missing).filter(
+                reduce(operator.or_, lookups),
+            ).values_list('pk', flat=True))
+            for pk in missing:
+                inherited[pk] = pk in found
+        return set([obj.pk for obj in objs if inherited[obj.pk]])
+
+    def load_shares(self, user_obj, content_type):
+        """
+        Loads the given user's, her groups' and scope shares applying to her
+        for the given content type, returning a (shares, expires) tuple as 
+        described in get_share_entry. Anonymous users only have public scope
+        shares.
+        """
+        now = datetime.now()
+        unexpired = get_unexpired_lookup(now)
+        querysets = [
+            ScopeShare.objects.filter(
+                unexpired,
+                content_type=content_type,
+                scope__in=get_scopes(user_obj),
+            ),
+        ]
+        if user_obj.is_authenticated() and effective.is_enabled():
+            querysets.append(
+                EffectiveShare.objects.filter(
+                    unexpired,
+                    content_type=content_type,
+                    user=user_obj,
+                ),
+            )
+        elif user_obj.is_authenticated():
+            querysets.extend([
+                UserShare.objects.filter(
+                    unexpired,
+                    content_type=content_type,
+                    user=user_obj,
+                ),
+                GroupShare.objects.filter(
+                    unexpired,
+                    content_type=content_type,
+                    group__in=user_obj.groups.all(),
+                ),
+            ])
+
+        shares = {}
+        expiries = []
+        verbs = list(enumerate(registry.get_verbs(content_type.model_class())))
+        fields = ('valid_from', 'valid_until', 'permissions') + SHARE_FIELDS
+        for qs in querysets:
+            for row in qs.values_list(get_content_type_object_field(content_type.id), *fields):
+                valid_from, valid_until, permissions = row[1:4]
+                if valid_from is not None and valid_from > now:
+                    expiries.append(valid_from)
+                    continue
+                if valid_until is not None:
+                    expiries.append(valid_until)
+                granted = shares.setdefault(row[0], set())
+                granted.update([field for field, value in zip(SHARE_FIELDS, row[4:]) if value])
+                if permissions:
+                    granted.update([verb for bit, verb in verbs if permissions & 1 << bit])
+        return shares, expiries and min(expiries) or None
+
     def has_perm(self, user_obj, perm, obj=None):
         """
-        Checks whether or not the given user or her groups has the given 
-        permission for the given object. 
+        Checks whether or not the given user, her groups or the scopes she 
+        belongs to have the given permission for the given object. Anonymous 
+        users only have permissions shared publicly.
         """
         # Ignore check without obj.
         if obj is None:
             return False
 
-        # Ignore if user is not authenticated .
-        if not user_obj.is_authenticated():
-            return False
-
         # Resolve permission.
-        try:
-            perm = 'can_%s' % perm.split('.')[-1].split('_')[0]
-        except IndexError:
+        field = get_share_field(perm, obj.__class__)
+        if field is None:
             return False
             
-        # Find shares for user and object content types.
-        content_type = ContentType.objects.get_for_model(obj)
-        user_shares = UserShare.objects.filter(
-            content_type=content_type,
-            object_id=obj.id,
-            user=user_obj,
-        )
-
-        # Return true if user has permission.
-        if user_shares.filter(**{perm: True}).exists():
-            return True
-        
-        # Find shares for user group and object content types.
-        group_shares = GroupShare.objects.filter(
-            content_type=content_type,
-            object_id=obj.id,
-            group__in=user_obj.groups.all(),
-        )
-
-        # Return true if user group has permission.
-        if group_shares.filter(**{perm: True}).exists():
-            return True
-
-        return False
+        # Return true if user or user group has permission.
+        measurement = stats.measure()
+        content_type = get_content_type(obj)
+        cache_hit = measurement and self.is_cached(user_obj, content_type)
+        result = field in self.get_shares(user_obj, content_type).get(get_object_key(obj), ()) \
+                or obj.pk in self.get_inherited(user_obj, field, [obj])
+        if measurement:
+            measurement.finish(self, 'has_perm', perm, content_type, cache_hit)
+        return result
+
+    def has_perms_for_objects(self, user_obj, perm, objs):
+        """
+        Checks whether or not the given user or her groups has the given
+        permission for each of the given objects, returning a dict mapping 
+        objects to booleans. Objects may be of mixed types, shares being 
+        loaded once per content type.
+        """
+        objs = list(objs)
+        perms = {}
+        measurement = stats.measure()
+        uninherited = {}
+        for obj in objs:
+            field = get_share_field(perm, obj.__class__)
+            if field is None:
+                perms[obj] = False
+                continue
+            content_type = get_content_type(obj)
+            perms[obj] = field in self.get_shares(user_obj, content_type).get(get_object_key(obj), ())
+            if not perms[obj]:
+                uninherited.setdefault(obj.__class__, []).append(obj)
+
+        # Resolve inherited shares once per model.
+        for model, model_objs in uninherited.items():
+            inherited = self.get_inherited(user_obj, get_share_field(perm, model), model_objs)
+            for obj in model_objs:
+                perms[obj] = obj.pk in inherited
+        if measurement:
+            measurement.finish(self, 'has_perms_for_objects', perm)
+        return perms
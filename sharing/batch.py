@@ -0,0 +1,58 @@
+from sharing import utils
+
+class LazyPermission(object):
+    """
+    Result of a permission check deferred by a PermissionBatch, resolving all 
+    of the batch's pending checks once evaluated as a boolean.
+    """
+    def __init__(self, batch, perm, obj):
+        self.batch = batch
+        self.perm = perm
+        self.obj = obj
+
+    def __nonzero__(self):
+        return self.batch.has_perm(self.perm, self.obj)
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        return '<LazyPermission: %s>' % self.perm
+
+class PermissionBatch(object):
+    """
+    Collects permission checks of a user, i.e. those issued concurrently while 
+    rendering a request, and resolves all pending checks together through 
+    utils.has_perms_for_objects using a constant number of queries per 
+    content type.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.pending = {}
+        self.results = {}
+
+    def check(self, perm, obj):
+        """
+        Defers checking the given permission for the given object, returning 
+        a LazyPermission.
+        """
+        if (perm, obj) not in self.results:
+            self.pending.setdefault(perm, set()).add(obj)
+        return LazyPermission(self, perm, obj)
+
+    def resolve(self):
+        """
+        Resolves all pending checks.
+        """
+        pending, self.pending = self.pending, {}
+        for perm, objs in pending.items():
+            for obj, granted in utils.has_perms_for_objects(self.user, perm, objs).items():
+                self.results[(perm, obj)] = granted
+
+    def has_perm(self, perm, obj):
+        """
+        Returns whether or not the user has the given permission for the given
+        object, resolving it along with all pending checks.
+        """
+        if (perm, obj) not in self.results:
+            self.check(perm, obj)
+            self.resolve()
+        return self.results[(perm, obj)]
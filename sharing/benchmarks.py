@@ -0,0 +1,145 @@
+"""
+Benchmarks measuring query counts and wall time of permission checks,
+queryset filtering and admin form fields against generated shares, as run by
+the sharing_benchmark management command.
+"""
+import random
+import time
+
+import django
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import Group, User
+from django.db import connection, reset_queries
+
+from sharing import utils
+from sharing.admin import ShareAdminMixin
+from sharing.backends import SharingBackend
+from sharing.models import GroupShare
+
+try:
+    # Django 1.3 and up.
+    from django.test.client import RequestFactory
+except ImportError:
+    from snippetscream import RequestFactory
+
+class BenchmarkAdmin(ShareAdminMixin, admin.ModelAdmin):
+    pass
+
+def generate(num_objects=1000, num_users=100, num_groups=10, num_shares=10000,
+        groups_per_user=2, seed=0):
+    """
+    Generates users, groups and shared objects, randomly sharing objects with
+    users and groups. Groups named 'object-<n>' serve as shared objects.
+    Returns the generated users and objects.
+    """
+    rand = random.Random(seed)
+    users = [User.objects.create(username='benchmark-user-%s' % i, is_staff=True) \
+            for i in range(num_users)]
+    groups = [Group.objects.create(name='benchmark-group-%s' % i) for i in range(num_groups)]
+    objects = [Group.objects.create(name='object-%s' % i) for i in range(num_objects)]
+
+    for user in users:
+        user.groups.add(*rand.sample(groups, min(groups_per_user, len(groups))))
+
+    def shares(principals, count):
+        for i in range(count):
+            yield rand.choice(principals), rand.choice(objects)
+    utils.grant_shares(shares(users, num_shares // 2), can_view=True)
+    utils.grant_shares(shares(groups, num_shares - num_shares // 2), can_view=True, can_change=True)
+    return users, objects
+
+def measure(name, func, repeat=1):
+    """
+    Calls func the given number of times, returning a result dict containing
+    the mean number of queries issued and seconds elapsed per call.
+    """
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    try:
+        queries = 0
+        seconds = 0.0
+        for i in range(repeat):
+            reset_queries()
+            start = time.time()
+            func()
+            seconds += time.time() - start
+            queries += len(connection.queries)
+        return {
+            'name': name,
+            'queries': float(queries) / repeat,
+            'seconds': seconds / repeat,
+        }
+    finally:
+        settings.DEBUG = debug
+        reset_queries()
+
+def run(users, objects, num_checks=100, repeat=3):
+    """
+    Runs benchmarks for the given generated users and objects, returning a list
+    of result dicts as returned by measure.
+    """
+    backend = SharingBackend()
+    checked = objects[:num_checks]
+    user = users[0]
+    site = admin.AdminSite()
+    request = RequestFactory().get('/')
+    request.user = user
+
+    def fresh_user():
+        return User.objects.get(pk=user.pk)
+
+    def has_perm_cold():
+        user_obj = fresh_user()
+        for obj in checked:
+            backend.has_perm(user_obj, 'view', obj)
+
+    def has_perm_warm():
+        for obj in checked:
+            backend.has_perm(user, 'view', obj)
+
+    def has_perms_for_objects():
+        utils.has_perms_for_objects(fresh_user(), 'view', checked)
+
+    def limit_queryset_by_permission():
+        list(utils.limit_queryset_by_permission(Group.objects.all(), 'view', user))
+
+    def admin_queryset():
+        # Count and fetch the first page as the changelist does.
+        qs = BenchmarkAdmin(Group, site).queryset(request)
+        qs.count()
+        list(qs[:100])
+
+    def formfield_for_foreignkey():
+        field = BenchmarkAdmin(GroupShare, site).formfield_for_foreignkey(
+                GroupShare._meta.get_field('group'), request)
+        list(field.choices)
+
+    def formfield_for_manytomany():
+        field = BenchmarkAdmin(User, site).formfield_for_manytomany(
+                User._meta.get_field('groups'), request)
+        list(field.choices)
+
+    # Warm up caches outside of measurements.
+    has_perm_warm()
+
+    return [
+        measure('has_perm.cold', has_perm_cold, repeat),
+        measure('has_perm.warm', has_perm_warm, repeat),
+        measure('has_perms_for_objects', has_perms_for_objects, repeat),
+        measure('limit_queryset_by_permission', limit_queryset_by_permission, repeat),
+        measure('admin.queryset', admin_queryset, repeat),
+        measure('admin.formfield_for_foreignkey', formfield_for_foreignkey, repeat),
+        measure('admin.formfield_for_manytomany', formfield_for_manytomany, repeat),
+    ]
+
+def environment():
+    """
+    Returns a dict describing the benchmark environment.
+    """
+    return {
+        'django': django.get_version(),
+        'database': connection.settings_dict['ENGINE'],
+        'sharing_cache': getattr(settings, 'SHARING_CACHE', False),
+        'sharing_effective_shares': getattr(settings, 'SHARING_EFFECTIVE_SHARES', False),
+    }
@@ -0,0 +1,153 @@
+import hashlib
+import itertools
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache as shared_cache
+from django.core.signals import request_finished
+from django.db import transaction
+
+# Incremented whenever shares or group memberships change, discarding share
+# caches built before the change.
+_generations = itertools.count(1)
+generation = 0
+
+# Shared cache version keys bumped during the current request.
+_pending = threading.local()
+
+# Maximum number of pending version keys kept per thread.
+MAX_PENDING = 1000
+
+# Version keys outlive share entries so evicted versions restart above any
+# version share entries might still be cached under.
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+def is_enabled():
+    """
+    Returns whether or not resolved shares are stored in Django's cache,
+    enabled with the SHARING_CACHE setting.
+    """
+    return getattr(settings, 'SHARING_CACHE', False)
+
+def get_timeout():
+    return getattr(settings, 'SHARING_CACHE_TIMEOUT', 60 * 60)
+
+def is_expired(expires):
+    """
+    Returns whether or not the given expiry time, None never expiring, has 
+    passed.
+    """
+    return expires is not None and expires <= datetime.now()
+
+def invalidate(user_ids=(), group_ids=(), scopes=False):
+    """
+    Invalidate share caches built so far, including shared cache entries of
+    the given users and groups, or of all users if scopes changed.
+    """
+    global generation
+    generation = next(_generations)
+
+    if is_enabled():
+        keys = [_version_key('user', user_id) for user_id in user_ids] + \
+            [_version_key('group', group_id) for group_id in group_ids]
+        if scopes:
+            keys.append(_version_key('scope', 'all'))
+        for key in keys:
+            _bump_version(key)
+
+        # Bump versions again once the request completes, after its
+        # transaction commits, orphaning entries cached from uncommitted state.
+        if not hasattr(_pending, 'keys'):
+            _pending.keys = set()
+        _pending.keys.update(keys)
+
+        # Outside of requests and commit_on_success, i.e. in task queues,
+        # pending versions are bumped once too many accumulate.
+        if len(_pending.keys) > MAX_PENDING:
+            bump_pending_versions()
+
+def bump_pending_versions(**kwargs):
+    """
+    Bump versions invalidated during the current request.
+    """
+    keys = getattr(_pending, 'keys', None)
+    if keys:
+        _pending.keys = set()
+        for key in keys:
+            _bump_version(key)
+
+request_finished.connect(bump_pending_versions)
+
+def commit_on_success(func):
+    """
+    Decorator running func within a transaction committed on success, as 
+    transaction.commit_on_success does, bumping versions invalidated by func 
+    again once committed. Entries cached from uncommitted state are thereby 
+    orphaned outside of requests too, i.e. in management commands.
+    """
+    func = transaction.commit_on_success(func)
+    @wraps(func)
+    def inner(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            bump_pending_versions()
+    return inner
+
+def get_shares(user_obj, content_type, load):
+    """
+    Returns the given user's resolved (shares, expires) tuple for the given 
+    content type from Django's cache, calling load to resolve and cache it on 
+    a miss. Entries are cached until the given expiry time at most, when 
+    shares become valid or expire.
+    """
+    key = _shares_key(user_obj, content_type)
+    entry = shared_cache.get(key)
+    if entry is None or is_expired(entry[1]):
+        entry = load()
+        timeout = get_timeout()
+        if entry[1] is not None:
+            delta = entry[1] - datetime.now()
+            timeout = max(1, min(timeout, delta.days * 60 * 60 * 24 + delta.seconds + 1))
+        shared_cache.set(key, entry, timeout)
+    return entry
+
+def _version_key(kind, pk):
+    return 'sharing:version:%s:%s' % (kind, pk)
+
+def _new_version():
+    return int(time.time() * 1000)
+
+def _bump_version(key):
+    try:
+        shared_cache.incr(key)
+    except ValueError:
+        shared_cache.set(key, _new_version(), VERSION_TIMEOUT)
+
+def _get_versions(keys):
+    versions = shared_cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            shared_cache.add(key, _new_version(), VERSION_TIMEOUT)
+            versions[key] = shared_cache.get(key)
+    return versions
+
+def _shares_key(user_obj, content_type):
+    """
+    Returns the cache key of the given user's shares for the given content
+    type, changing whenever the user's, any of her groups' or scope shares 
+    change.
+    """
+    if getattr(user_obj, '_share_group_ids_generation', None) != generation:
+        user_obj._share_group_ids = user_obj.is_authenticated() and \
+                sorted(user_obj.groups.values_list('id', flat=True)) or []
+        user_obj._share_group_ids_generation = generation
+
+    keys = [_version_key('scope', 'all'), _version_key('user', user_obj.pk)] + \
+        [_version_key('group', group_id) for group_id in user_obj._share_group_ids]
+    versions = _get_versions(keys)
+    digest = hashlib.md5(','.join(['%s=%s' % (key, versions[key]) for key in keys])).hexdigest()
+    return 'sharing:entry:%s:%s:%s' % (user_obj.pk, content_type.id, digest)
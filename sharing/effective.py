@@ -0,0 +1,132 @@
+"""
+Maintenance of effective shares, combining each user's own and group shares
+per object, enabled with the SHARING_EFFECTIVE_SHARES setting.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from sharing.models import SHARE_FIELDS, EffectiveShare, GroupShare, UserShare, \
+        get_content_type_object_field, get_unexpired_lookup
+
+def is_enabled():
+    """
+    Returns whether or not effective shares are maintained and used to
+    resolve permissions.
+    """
+    return getattr(settings, 'SHARING_EFFECTIVE_SHARES', False)
+
+def compute(user_ids, content_type_id=None, object_keys=None):
+    """
+    Returns a dict mapping (user id, content type id, object id, object pk,
+    valid from, valid until) keys to the combined permissions of the given 
+    users' own and group shares, optionally limited to objects of the given 
+    content type and primary keys. Expired shares are skipped.
+    """
+    share_filters = {}
+    unexpired = get_unexpired_lookup()
+    if content_type_id is not None:
+        share_filters['content_type'] = content_type_id
+        if object_keys is not None:
+            share_filters['%s__in' % get_content_type_object_field(content_type_id)] = object_keys
+
+    computed = {}
+    def grant(user_id, row):
+        granted = computed.setdefault((user_id,) + tuple(row[:5]), dict([(field, False) for field in SHARE_FIELDS], permissions=0))
+        for field, value in zip(SHARE_FIELDS, row[6:]):
+            granted[field] = granted[field] or value
+        granted['permissions'] |= row[5]
+
+    fields = ('content_type', 'object_id', 'object_pk', 'valid_from', 'valid_until', 'permissions') + SHARE_FIELDS
+    for row in UserShare.objects.filter(unexpired, user__in=user_ids, **share_filters).values_list('user', *fields):
+        grant(row[0], row[1:])
+
+    # Only memberships of groups holding matching shares are loaded.
+    group_shares = GroupShare.objects.filter(unexpired, **share_filters)
+    memberships = {}
+    for user_id, group_id in User.groups.through.objects.filter(user__in=user_ids, 
+            group__in=group_shares.values('group')).values_list('user', 'group'):
+        memberships.setdefault(group_id, []).append(user_id)
+    if memberships:
+        group_shares = group_shares.filter(group__in=memberships.keys())
+        for row in group_shares.values_list('group', *fields):
+            for user_id in memberships[row[0]]:
+                grant(user_id, row[1:])
+
+    return computed
+
+def replace(computed, **filters):
+    """
+    Replace effective shares matching the given filters with the given
+    computed shares.
+    """
+    EffectiveShare.objects.filter(**filters).delete()
+    shares = [EffectiveShare(
+        user_id=user_id,
+        content_type_id=content_type_id,
+        object_id=object_id,
+        object_pk=object_pk,
+        valid_from=valid_from,
+        valid_until=valid_until,
+        **granted
+    ) for (user_id, content_type_id, object_id, object_pk, valid_from, valid_until), granted \
+            in computed.items() \
+            if [value for value in granted.values() if value]]
+
+    # Insert in bulk where supported, i.e. Django 1.4 and up.
+    if hasattr(EffectiveShare.objects, 'bulk_create'):
+        EffectiveShare.objects.bulk_create(shares)
+    else:
+        for share in shares:
+            share.save(force_insert=True)
+
+def refresh_object(content_type_id, object_key, user_ids=()):
+    """
+    Refresh effective shares of the given object for the given users and
+    users currently holding effective shares of it.
+    """
+    refresh_objects(content_type_id, [object_key], user_ids)
+
+def refresh_objects(content_type_id, object_keys, user_ids=(), batch_size=500):
+    """
+    Refresh effective shares of the given objects of a content type, given by
+    primary key, for the given users and users currently holding effective 
+    shares of them, processing users in batches of the given size.
+    """
+    object_keys = list(object_keys)
+    object_filters = {
+        'content_type': content_type_id,
+        '%s__in' % get_content_type_object_field(content_type_id): object_keys,
+    }
+    user_ids = set(user_ids)
+    user_ids.update(EffectiveShare.objects.filter(**object_filters).values_list('user', flat=True))
+    for batch in _batches(sorted(user_ids), batch_size):
+        replace(
+            compute(batch, content_type_id, object_keys),
+            user__in=batch,
+            **object_filters
+        )
+
+def refresh_users(user_ids, batch_size=500):
+    """
+    Refresh all effective shares of the given users, processing users in 
+    batches of the given size.
+    """
+    for batch in _batches(list(user_ids), batch_size):
+        replace(compute(batch), user__in=batch)
+
+def rebuild(batch_size=500):
+    """
+    Rebuild all effective shares, processing users in batches of the given
+    size. Returns the number of users processed.
+    """
+    EffectiveShare.objects.all().delete()
+    user_ids = list(User.objects.values_list('id', flat=True).order_by('id'))
+    refresh_users(user_ids, batch_size)
+    return len(user_ids)
+
+def _batches(user_ids, batch_size):
+    """
+    Splits the given user ids into lists of the given size, keeping query 
+    parameter lists within database limits for large groups.
+    """
+    return [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
@@ -0,0 +1,187 @@
+"""
+Admin changelist filters narrowing objects by how the requesting user has
+been granted access to them, applied as share subqueries on top of the
+changelist's permission limited queryset.
+"""
+import inspect
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+
+from sharing import utils
+
+try:
+    # Django 1.4 and up.
+    from django.contrib.admin import SimpleListFilter
+except ImportError:
+    SimpleListFilter = None
+
+# Query string parameter holding the selected share source.
+SHARE_SOURCE_VAR = 'shared'
+
+SOURCE_USER = 'me'
+SOURCE_OWNER = 'owned'
+
+def get_share_source_lookups(groups):
+    """
+    Returns (value, label) pairs of the share sources offered for a user
+    member of the given groups.
+    """
+    return [
+        (SOURCE_USER, 'Shared with me'),
+        (SOURCE_OWNER, 'Owned by me'),
+    ] + [(str(group.pk), 'Shared with %s' % group) for group in groups]
+
+def filter_share_source(qs, source, user, groups, model_admin):
+    """
+    Returns the given queryset filtered to objects shared with the given
+    user by the given share source, raising IncorrectLookupParameters for
+    unknown sources. Owned objects are those referencing the user by the
+    admin class' share_owner_field, or if not set those she holds a full user
+    share for, as created on admin save.
+    """
+    if source == SOURCE_USER:
+        return utils.limit_queryset_by_share(qs, user)
+    if source == SOURCE_OWNER:
+        owner_field = model_admin.share_owner_field
+        if owner_field:
+            return qs.filter(**{owner_field: user})
+        return utils.limit_queryset_by_share(qs, user, perms=('view', 'change', 'delete'))
+    for group in groups:
+        if source == str(group.pk):
+            return utils.limit_queryset_by_share(qs, group)
+    raise IncorrectLookupParameters
+
+class ShareSourceFilterSpec(object):
+    """
+    Changelist filter spec offering objects shared with the requesting user
+    directly, owned by her or shared with one of her groups, for Django
+    versions prior to 1.4 which only filter by fields.
+    """
+    def __init__(self, request, params, model, model_admin):
+        self.user = request.user
+        self.model_admin = model_admin
+        self.groups = list(request.user.groups.all())
+        self.value = params.get(SHARE_SOURCE_VAR)
+
+    def has_output(self):
+        return True
+
+    def title(self):
+        return 'access'
+
+    def choices(self, cl):
+        yield {
+            'selected': self.value is None,
+            'query_string': cl.get_query_string({}, [SHARE_SOURCE_VAR]),
+            'display': 'All',
+        }
+        for value, display in get_share_source_lookups(self.groups):
+            yield {
+                'selected': self.value == value,
+                'query_string': cl.get_query_string({SHARE_SOURCE_VAR: value}),
+                'display': display,
+            }
+
+    def queryset(self, qs):
+        if self.value is None:
+            return qs
+        return filter_share_source(qs, self.value, self.user, self.groups, self.model_admin)
+
+if SimpleListFilter is not None:
+    class ShareSourceListFilter(SimpleListFilter):
+        """
+        List filter offering objects shared with the requesting user directly,
+        owned by her or shared with one of her groups.
+        """
+        title = 'access'
+        parameter_name = SHARE_SOURCE_VAR
+
+        def __init__(self, request, params, model, model_admin):
+            # Lookups are resolved on init and filtering needs the admin class.
+            self.model_admin = model_admin
+            super(ShareSourceListFilter, self).__init__(request, params, model, model_admin)
+
+        def lookups(self, request, model_admin):
+            self.groups = list(request.user.groups.all())
+            return get_share_source_lookups(self.groups)
+
+        def queryset(self, request, queryset):
+            if self.value() is None:
+                return queryset
+            return filter_share_source(queryset, self.value(), request.user, self.groups, self.model_admin)
+
+class ShareChangeList(ChangeList):
+    """
+    ChangeList applying the share source filter if enabled by the admin
+    class' share_source_filter, and resolving the principals sharing each
+    listed object at once for the admin class' share_sources column.
+    """
+    def __init__(self, request, *args, **kwargs):
+        # Filter specs are needed by get_query_set, called on init.
+        self.request = request
+        super(ShareChangeList, self).__init__(request, *args, **kwargs)
+
+    def get_query_set(self, *args, **kwargs):
+        if SimpleListFilter is not None:
+            return super(ShareChangeList, self).get_query_set(*args, **kwargs)
+
+        # The share source is not a field lookup.
+        value = self.params.pop(SHARE_SOURCE_VAR, None)
+        try:
+            qs = super(ShareChangeList, self).get_query_set(*args, **kwargs)
+        finally:
+            if value is not None:
+                self.params[SHARE_SOURCE_VAR] = value
+        if value is not None:
+            if not self.model_admin.share_source_filter:
+                raise IncorrectLookupParameters
+            qs = self.get_share_source_spec().queryset(qs)
+        return qs
+
+    def get_results(self, request):
+        super(ShareChangeList, self).get_results(request)
+        if 'share_sources' in self.list_display:
+            objs = list(self.result_list)
+            principals = utils.get_share_principals(request.user, objs)
+            for obj in objs:
+                obj._share_principals = principals[obj]
+
+    def get_filters(self, request):
+        if SimpleListFilter is not None:
+            if self.model_admin.share_source_filter and ShareSourceListFilter not in self.list_filter:
+                self.list_filter = list(self.list_filter) + [ShareSourceListFilter]
+            return super(ShareChangeList, self).get_filters(request)
+
+        filter_specs, has_filters = super(ShareChangeList, self).get_filters(request)
+        if self.model_admin.share_source_filter:
+            filter_specs.append(self.get_share_source_spec())
+        return filter_specs, bool(filter_specs)
+
+    def get_share_source_spec(self):
+        if not hasattr(self, '_share_source_spec'):
+            self._share_source_spec = ShareSourceFilterSpec(self.request, self.params,
+                    self.model, self.model_admin)
+        return self._share_source_spec
+
+# Maps ChangeList classes to their subclasses applying ShareChangeList.
+_share_changelist_classes = {}
+
+def get_share_changelist_class(changelist_class):
+    """
+    Returns a subclass of the given ChangeList class applying ShareChangeList,
+    created once per class, or the class itself if it already applies it.
+    """
+    if ShareChangeList in inspect.getmro(changelist_class):
+        return changelist_class
+    if changelist_class is ChangeList:
+        return ShareChangeList
+    try:
+        return _share_changelist_classes[changelist_class]
+    except KeyError:
+        share_changelist_class = _share_changelist_classes[changelist_class] = type(
+            "%sShareMixin" % changelist_class.__name__,
+            (ShareChangeList, changelist_class,),
+            {},
+        )
+        return share_changelist_class
@@ -0,0 +1,67 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.utils import simplejson
+
+from sharing import benchmarks
+
+class Command(NoArgsCommand):
+    help = "Benchmarks permission checks, queryset filtering and admin form fields against generated shares in a test database, writing JSON results."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--objects', action='store', type='int', dest='num_objects', default=1000,
+            help='Number of shared objects to generate.'),
+        make_option('--users', action='store', type='int', dest='num_users', default=100,
+            help='Number of users to generate.'),
+        make_option('--groups', action='store', type='int', dest='num_groups', default=10,
+            help='Number of groups to generate.'),
+        make_option('--shares', action='store', type='int', dest='num_shares', default=10000,
+            help='Number of shares to generate, split between users and groups.'),
+        make_option('--checks', action='store', type='int', dest='num_checks', default=100,
+            help='Number of objects to check permissions for per run.'),
+        make_option('--repeat', action='store', type='int', dest='repeat', default=3,
+            help='Number of runs to average results over.'),
+        make_option('--seed', action='store', type='int', dest='seed', default=0,
+            help='Random seed used to generate shares.'),
+        make_option('--output', action='store', dest='output', default=None,
+            help='File to write results to, defaults to standard output.'),
+    )
+
+    def handle_noargs(self, **options):
+        params = dict([(key, options.get(key)) for key in \
+                ('num_objects', 'num_users', 'num_groups', 'num_shares', 'num_checks', 'repeat', 'seed')])
+
+        # Never generate data in the configured database.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            start = time.time()
+            users, objects = benchmarks.generate(
+                num_objects=params['num_objects'],
+                num_users=params['num_users'],
+                num_groups=params['num_groups'],
+                num_shares=params['num_shares'],
+                seed=params['seed'],
+            )
+            generation_seconds = time.time() - start
+            results = benchmarks.run(users, objects, num_checks=params['num_checks'], repeat=params['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            # Django 1.4 leaves restoring the name to the test runner.
+            connection.settings_dict['NAME'] = old_name
+
+        output = simplejson.dumps({
+            'environment': benchmarks.environment(),
+            'params': params,
+            'generation_seconds': generation_seconds,
+            'results': results,
+        }, indent=2)
+        if options.get('output'):
+            f = open(options['output'], 'w')
+            try:
+                f.write(output)
+            finally:
+                f.close()
+        else:
+            self.stdout.write(output + '\n')
@@ -0,0 +1,81 @@
+import csv
+import sys
+from optparse import make_option
+
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_model
+from django.utils import simplejson
+
+from sharing import utils
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = "Grants or revokes shares listed in a CSV or JSON lines file, or standard input if the file is '-'. Rows provide principal ('user' or 'group'), principal_id, model ('app_label.model') and object_id values."
+    option_list = BaseCommand.option_list + (
+        make_option('--revoke', action='store_true', dest='revoke', default=False,
+            help='Revoke instead of grant the given permissions, or all permissions if none are given.'),
+        make_option('--format', action='store', dest='format', default='csv',
+            help="Input format, either 'csv' (with a header row) or 'jsonl'. Defaults to 'csv'."),
+        make_option('--view', action='store_true', dest='can_view', default=False,
+            help='Grant or revoke view permission.'),
+        make_option('--change', action='store_true', dest='can_change', default=False,
+            help='Grant or revoke change permission.'),
+        make_option('--delete', action='store_true', dest='can_delete', default=False,
+            help='Grant or revoke delete permission.'),
+        make_option('--verb', action='append', dest='verbs', default=[],
+            help='Grant or revoke a custom verb registered for the shared models, may be given multiple times.'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=500,
+            help='Number of rows to write at a time.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Provide a single file to read shares from.")
+        if options.get('format') not in ('csv', 'jsonl'):
+            raise CommandError("Unknown format '%s'." % options.get('format'))
+
+        perms = dict([(field, options.get(field)) for field in ('can_view', 'can_change', 'can_delete')])
+        perms['verbs'] = options.get('verbs')
+        if not options.get('revoke') and not [value for value in perms.values() if value]:
+            raise CommandError("Provide at least one of --view, --change, --delete and --verb to grant.")
+
+        stream = args[0] == '-' and sys.stdin or open(args[0], 'rb')
+        try:
+            shares = self.read_shares(stream, options.get('format'))
+            if options.get('revoke'):
+                count = utils.revoke_shares(shares, batch_size=options.get('batch_size'), **perms)
+                message = "Deleted %s shares.\n"
+            else:
+                count = utils.grant_shares(shares, batch_size=options.get('batch_size'), **perms)
+                message = "Created %s shares.\n"
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if int(options.get('verbosity', 1)):
+            self.stdout.write(message % count)
+
+    def read_shares(self, stream, format):
+        """
+        Yields (principal, object) pairs read from the given stream. Principals
+        and objects are not fetched, only their primary keys are set.
+        """
+        if format == 'csv':
+            rows = csv.DictReader(stream)
+        else:
+            rows = (simplejson.loads(line) for line in stream if line.strip())
+
+        principal_models = {'user': User, 'group': Group}
+        for row in rows:
+            try:
+                principal_model = principal_models[row['principal']]
+                model = get_model(*row['model'].split('.'))
+                if model is None:
+                    raise CommandError("Unknown model '%s'." % row['model'])
+                yield (
+                    principal_model(pk=principal_model._meta.pk.to_python(row['principal_id'])),
+                    model(pk=model._meta.pk.to_python(row['object_id'])),
+                )
+            except (KeyError, TypeError, ValueError):
+                raise CommandError("Invalid share row %r." % (row,))
@@ -0,0 +1,74 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import DatabaseError, connection, transaction
+
+from sharing import cache, utils
+from sharing.models import EffectiveShare, GroupShare, UserShare
+
+class Command(NoArgsCommand):
+    help = "Merges duplicate user and group shares, optionally creating the share unique constraints and indexes, including effective share object indexes, afterwards. Run once the new share columns and tables exist when upgrading installs created prior to django-sharing 0.0.3."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Report duplicate shares without merging them.'),
+        make_option('--create-indexes', action='store_true', dest='create_indexes', default=False,
+            help='Create share unique constraints and indexes after merging duplicates.'),
+    )
+
+    def handle_noargs(self, **options):
+        dry_run = options.get('dry_run')
+        verbosity = int(options.get('verbosity', 1))
+
+        for share_model, principal_field in ((GroupShare, 'group'), (UserShare, 'user')):
+            removed = self.merge(share_model, principal_field, dry_run)
+            if verbosity:
+                self.stdout.write("%s %s duplicate %s objects.\n" % (dry_run and 'Found' or 'Removed', removed, share_model.__name__))
+
+            if options.get('create_indexes') and not dry_run:
+                for sql in self.index_sql(share_model, principal_field):
+                    if verbosity > 1:
+                        self.stdout.write("%s\n" % sql)
+                    self.execute_sql(sql)
+
+        # Effective shares are rebuilt rather than merged, but need indexing
+        # for object lookups. Tables created by syncdb are already indexed.
+        if options.get('create_indexes') and not dry_run:
+            for sql in self.index_sql(EffectiveShare):
+                if verbosity > 1:
+                    self.stdout.write("%s\n" % sql)
+                try:
+                    self.execute_sql(sql)
+                except DatabaseError:
+                    if verbosity:
+                        self.stdout.write("Skipped existing index: %s\n" % sys.exc_info()[1])
+
+    @cache.commit_on_success
+    def merge(self, share_model, principal_field, dry_run):
+        return utils.merge_duplicate_shares(share_model, principal_field, dry_run=dry_run)
+
+    @transaction.commit_on_success
+    def execute_sql(self, sql):
+        connection.cursor().execute(sql)
+
+    def index_sql(self, share_model, principal_field=None):
+        """
+        Returns statements creating the indexes fresh installs get from syncdb,
+        including unique constraints per principal if a principal field is 
+        given.
+        """
+        qn = connection.ops.quote_name
+        table = share_model._meta.db_table
+        statements = []
+        for object_column in ('object_id', 'object_pk'):
+            if principal_field is not None:
+                statements.append("CREATE UNIQUE INDEX %s ON %s (%s, %s, %s);" % (
+                    qn('%s_%s_content_%s_unique' % (table, principal_field, object_column)), qn(table),
+                    qn(share_model._meta.get_field(principal_field).column), qn('content_type_id'), 
+                    qn(object_column),
+                ))
+            statements.append("CREATE INDEX %s ON %s (%s, %s);" % (
+                qn('%s_content_%s' % (table, object_column)), qn(table),
+                qn('content_type_id'), qn(object_column),
+            ))
+        return statements
@@ -0,0 +1,84 @@
+import csv
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db.models import get_model
+from django.utils import simplejson
+
+from sharing import utils
+
+class Command(NoArgsCommand):
+    help = "Exports the users with a permission for an object, or the objects a user has a permission for, as CSV or JSON lines streamed in chunks."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--object', action='store', dest='object', default=None,
+            help="Object to export users with access to, as 'app_label.model:pk'."),
+        make_option('--user', action='store', dest='user', default=None,
+            help='Primary key of the user to export accessible objects of.'),
+        make_option('--perm', action='store', dest='perm', default='view',
+            help="Permission to export access for, i.e. 'view' or 'change'. Defaults to 'view'."),
+        make_option('--format', action='store', dest='format', default='csv',
+            help="Output format, either 'csv' (with a header row) or 'jsonl'. Defaults to 'csv'."),
+        make_option('--output', action='store', dest='output', default=None,
+            help='File to write to, defaults to standard output.'),
+        make_option('--chunk-size', action='store', type='int', dest='chunk_size', default=1000,
+            help='Number of rows to fetch at a time.'),
+    )
+
+    def handle_noargs(self, **options):
+        if bool(options.get('object')) == bool(options.get('user')):
+            raise CommandError("Provide either --object or --user.")
+        if options.get('format') not in ('csv', 'jsonl'):
+            raise CommandError("Unknown format '%s'." % options.get('format'))
+
+        if options.get('object'):
+            fields = ('user_id', 'username')
+            rows = self.user_rows(self.get_object(options.get('object')), options)
+        else:
+            try:
+                user = User.objects.get(pk=options.get('user'))
+            except (User.DoesNotExist, ValueError):
+                raise CommandError("Unknown user '%s'." % options.get('user'))
+            fields = ('model', 'object_id')
+            rows = self.object_rows(user, options)
+
+        stream = options.get('output') and open(options.get('output'), 'wb') or self.stdout
+        try:
+            self.write_rows(stream, options.get('format'), fields, rows)
+        finally:
+            if stream is not self.stdout:
+                stream.close()
+
+    def get_object(self, value):
+        try:
+            label, pk = value.split(':', 1)
+            model = get_model(*label.split('.'))
+        except (TypeError, ValueError):
+            model = None
+        if model is None:
+            raise CommandError("Invalid object '%s', expected 'app_label.model:pk'." % value)
+        try:
+            return model._default_manager.get(pk=pk)
+        except (model.DoesNotExist, ValueError):
+            raise CommandError("Unknown object '%s'." % value)
+
+    def user_rows(self, obj, options):
+        for user in utils.users_with_perm(obj, options.get('perm'), chunk_size=options.get('chunk_size')):
+            yield (user.pk, user.username)
+
+    def object_rows(self, user, options):
+        for obj in utils.objects_for_user(user, options.get('perm'), chunk_size=options.get('chunk_size')):
+            yield ('%s.%s' % (obj._meta.app_label, obj._meta.object_name.lower()), obj.pk)
+
+    def write_rows(self, stream, format, fields, rows):
+        """
+        Writes the given rows to the given stream as they are consumed.
+        """
+        if format == 'csv':
+            writer = csv.writer(stream)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow([unicode(value).encode('utf-8') for value in row])
+        else:
+            for row in rows:
+                stream.write(simplejson.dumps(dict(zip(fields, row))) + '\n')
@@ -0,0 +1,19 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from sharing import utils
+from sharing.models import EffectiveShare, GroupShare, ScopeShare, UserShare
+
+class Command(NoArgsCommand):
+    help = "Deletes expired user, group, scope and effective shares in batches."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=500,
+            help='Number of shares to delete per transaction.'),
+    )
+
+    def handle_noargs(self, **options):
+        for share_model in (UserShare, GroupShare, ScopeShare, EffectiveShare):
+            deleted = utils.purge_expired_shares(share_model, batch_size=options.get('batch_size'))
+            if int(options.get('verbosity', 1)):
+                self.stdout.write("Deleted %s expired %s objects.\n" % (deleted, share_model.__name__))
@@ -0,0 +1,76 @@
+import os
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db.models import get_model
+from django.utils import simplejson
+
+from sharing import utils
+from sharing.models import EffectiveShare, GroupShare, ScopeShare, UserShare
+from sharing.registry import get_content_type
+
+class Command(NoArgsCommand):
+    help = "Deletes user, group, scope and effective shares of objects that no longer exist, per content type in batches. Progress can be saved to a state file to resume interrupted runs."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=500,
+            help='Number of shares to check and delete per transaction.'),
+        make_option('--content-type', action='store', dest='content_type', default=None,
+            help="Only purge shares of the given model, as 'app_label.model'."),
+        make_option('--state-file', action='store', dest='state_file', default=None,
+            help='File storing the last share checked per share model and content type, resuming from it if it exists.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        state_file = options.get('state_file')
+        state = self.load_state(state_file)
+
+        content_type_id = None
+        if options.get('content_type'):
+            try:
+                model = get_model(*options.get('content_type').split('.'))
+            except TypeError:
+                model = None
+            if model is None:
+                raise CommandError("Unknown model '%s'." % options.get('content_type'))
+            content_type_id = get_content_type(model).id
+
+        for share_model in (UserShare, GroupShare, ScopeShare, EffectiveShare):
+            content_type_ids = share_model.objects.order_by('content_type').values_list('content_type', flat=True).distinct()
+            if content_type_id is not None:
+                content_type_ids = content_type_ids.filter(content_type=content_type_id)
+            for shared_content_type_id in list(content_type_ids):
+                key = '%s:%s' % (share_model.__name__, shared_content_type_id)
+                content_type = ContentType.objects.get_for_id(shared_content_type_id)
+                label = '%s %s.%s' % (share_model.__name__, content_type.app_label, content_type.model)
+                deleted = 0
+                for last_id, num_deleted in utils.purge_orphaned_shares(share_model, shared_content_type_id,
+                        batch_size=options.get('batch_size'), after_id=state.get(key, 0)):
+                    deleted += num_deleted
+                    state[key] = last_id
+                    self.save_state(state_file, state)
+                    if verbosity > 1:
+                        self.stdout.write("%s: checked up to id %s, deleted %s orphaned shares.\n" % (label, last_id, deleted))
+                if verbosity:
+                    self.stdout.write("Deleted %s orphaned %s objects.\n" % (deleted, label))
+
+    def load_state(self, state_file):
+        if not state_file or not os.path.exists(state_file):
+            return {}
+        try:
+            return simplejson.load(open(state_file))
+        except ValueError:
+            raise CommandError("Invalid state file '%s'." % state_file)
+
+    def save_state(self, state_file, state):
+        """
+        Saves progress after each committed batch.
+        """
+        if not state_file:
+            return
+        stream = open(state_file, 'w')
+        try:
+            simplejson.dump(state, stream)
+        finally:
+            stream.close()
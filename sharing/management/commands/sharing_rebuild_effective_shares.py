@@ -0,0 +1,18 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from sharing import cache, effective
+
+class Command(NoArgsCommand):
+    help = "Rebuilds effective shares from user and group shares, as used when the SHARING_EFFECTIVE_SHARES setting is enabled."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=500,
+            help='Number of users to rebuild effective shares for at a time.'),
+    )
+
+    @cache.commit_on_success
+    def handle_noargs(self, **options):
+        num_users = effective.rebuild(batch_size=options.get('batch_size'))
+        if int(options.get('verbosity', 1)):
+            self.stdout.write("Rebuilt effective shares for %s users.\n" % num_users)
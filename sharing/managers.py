@@ -0,0 +1,29 @@
+from django.db import models
+from django.db.models.query import QuerySet
+
+from sharing import utils
+
+class SharedQuerySetMixin(object):
+    """
+    QuerySet mixin limiting objects to those shared with a user.
+    """
+    def visible_to(self, user, perm='view'):
+        """
+        Returns objects the given user has the given permission for, i.e. 
+        'view' or 'change', as a lazy queryset filtered with share subqueries.
+        """
+        return utils.limit_queryset_by_permission(self, perm, user)
+
+class SharedQuerySet(SharedQuerySetMixin, QuerySet):
+    pass
+
+class SharedManager(models.Manager):
+    """
+    Manager providing visible_to for limiting objects to those shared with a
+    user, i.e. Article.objects.visible_to(request.user).
+    """
+    def get_query_set(self):
+        return SharedQuerySet(self.model, using=self._db)
+
+    def visible_to(self, user, perm='view'):
+        return self.get_query_set().visible_to(user, perm)
@@ -0,0 +1,20 @@
+from sharing import signals, stats
+
+signals.permission_checked.connect(stats.collect, dispatch_uid='sharing.stats.collect')
+
+class SharingStatsMiddleware(object):
+    """
+    Aggregates the cost of permission checks per request, available as 
+    request.sharing_stats and sent with the request_stats signal once the 
+    response is ready.
+    """
+    def process_request(self, request):
+        request.sharing_stats = stats.SharingStats()
+        stats.set_current(request.sharing_stats)
+
+    def process_response(self, request, response):
+        request_stats = getattr(request, 'sharing_stats', None)
+        stats.set_current(None)
+        if request_stats is not None:
+            signals.request_stats.send(sender=self, request=request, stats=request_stats)
+        return response
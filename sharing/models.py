@@ -1,6 +1,87 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.contrib.auth.models import User
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models import Q, signals
+from django.utils.encoding import smart_unicode
+
+from sharing import cache
+from sharing.registry import SHARE_FIELDS, get_content_type
+
+# Bulk share operations in progress on the current thread.
+_bulk = threading.local()
+
+# Whether or not shares exist per content type id along with the time checked,
+# valid for the share cache generation they were checked at.
+_shared_content_types = {}
+_shared_content_types_generation = None
+
+# Seconds content types without shares are memoised for.
+SHARED_CONTENT_TYPE_TIMEOUT = 60
+
+# Keys of objects deleted per model within the current thread's
+# deferred_share_cleanup block.
+_deferred_cleanup = threading.local()
+
+INTEGER_FIELDS = ('AutoField', 'BigIntegerField', 'IntegerField', 'PositiveIntegerField', 
+        'PositiveSmallIntegerField', 'SmallIntegerField')
+
+# Maps models to their share object field.
+_object_fields = {}
+
+def get_object_field(model):
+    """
+    Returns the name of the share field storing primary keys of the given 
+    model, object_id for integer primary keys and object_pk otherwise. Share 
+    lookups thereby compare values of the primary key's own type without 
+    casting, keeping them index friendly.
+    """
+    try:
+        return _object_fields[model]
+    except KeyError:
+        pk = model._meta.pk
+        while pk.rel is not None:
+            pk = pk.rel.get_related_field()
+        field = _object_fields[model] = pk.get_internal_type() in INTEGER_FIELDS \
+                and 'object_id' or 'object_pk'
+        return field
+
+def get_content_type_object_field(content_type_id):
+    """
+    Returns get_object_field for the model of the given content type.
+    """
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    return model and get_object_field(model) or 'object_id'
+
+def get_valid_lookup(now=None):
+    """
+    Returns a Q object matching shares valid at the given time, defaulting 
+    to now.
+    """
+    now = now or datetime.now()
+    return (Q(valid_from__isnull=True) | Q(valid_from__lte=now)) & \
+            (Q(valid_until__isnull=True) | Q(valid_until__gt=now))
+
+def get_unexpired_lookup(now=None):
+    """
+    Returns a Q object matching shares not yet expired at the given time, 
+    defaulting to now, including shares not yet valid.
+    """
+    return Q(valid_until__isnull=True) | Q(valid_until__gt=now or datetime.now())
+
+def get_object_key(obj):
+    """
+    Returns the primary key of the given object as stored by shares in the 
+    field returned by get_object_field.
+    """
+    if get_object_field(obj.__class__) == 'object_id':
+        return obj.pk
+    return smart_unicode(obj.pk)
 
 class Share(models.Model):
     """
@@ -10,13 +91,41 @@ class Share(models.Model):
     can_change = models.BooleanField()
     can_delete = models.BooleanField()
 
+    # Bitmask of custom verbs granted, as registered with 
+    # sharing.registry.register_verbs.
+    permissions = models.PositiveIntegerField(default=0, db_index=True)
+
     content_type = models.ForeignKey(ContentType)
-    object_id = models.IntegerField()
+    object_id = models.IntegerField(blank=True, null=True)
+    object_pk = models.CharField(max_length=255, blank=True, null=True)
     content_object = generic.GenericForeignKey('content_type', 'object_id')
+    content_object_by_pk = generic.GenericForeignKey('content_type', 'object_pk')
+
+    # Optional window outside of which the share grants nothing.
+    valid_from = models.DateTimeField(blank=True, null=True)
+    valid_until = models.DateTimeField(blank=True, null=True, db_index=True)
 
     class Meta:
         abstract = True
 
+    def get_object_key(self):
+        """
+        Returns the shared object's primary key, as stored in object_id for 
+        integer primary keys or object_pk otherwise.
+        """
+        if self.object_id is not None:
+            return self.object_id
+        return self.object_pk
+
+    def is_valid(self, now=None):
+        """
+        Returns whether or not the share grants its permissions at the given 
+        time, defaulting to now, as matched by get_valid_lookup.
+        """
+        now = now or datetime.now()
+        return (self.valid_from is None or self.valid_from <= now) and \
+                (self.valid_until is None or self.valid_until > now)
+
 class GroupShare(Share):
     """
     Group share model associating object permissions with a group.
@@ -25,10 +134,12 @@ class GroupShare(Share):
         'auth.Group',
     )
 
-    # TODO: Until such time as this bug (http://code.djangoproject.com/ticket/12028) 
-    # is resolved we can't guarantee uniqueness.
-    #class Meta:
-    #    unique_together = (('group', 'content_type', 'object_id'),)
+    class Meta:
+        # Leading principal column also indexes per principal share lookups.
+        unique_together = (
+            ('group', 'content_type', 'object_id'),
+            ('group', 'content_type', 'object_pk'),
+        )
     
     def __unicode__(self):
         return '%s share' % self.group
@@ -42,10 +153,223 @@ class UserShare(Share):
         limit_choices_to={'is_staff': True,},
     )
     
-    # TODO: Until such time as this bug (http://code.djangoproject.com/ticket/12028) 
-    # is resolved we can't guarantee uniqueness.
-    #class Meta:
-    #    unique_together = (('user', 'content_type', 'object_id'),)
+    class Meta:
+        # Leading principal column also indexes per principal share lookups.
+        unique_together = (
+            ('user', 'content_type', 'object_id'),
+            ('user', 'content_type', 'object_pk'),
+        )
     
     def __unicode__(self):
         return '%s share' % self.user
+
+SCOPE_PUBLIC = 'public'
+SCOPE_AUTHENTICATED = 'authenticated'
+SCOPE_CHOICES = (
+    (SCOPE_PUBLIC, 'Everyone'),
+    (SCOPE_AUTHENTICATED, 'Authenticated users'),
+)
+
+def get_scopes(user_obj):
+    """
+    Returns the share scopes applying to the given user.
+    """
+    if user_obj.is_authenticated():
+        return (SCOPE_PUBLIC, SCOPE_AUTHENTICATED)
+    return (SCOPE_PUBLIC,)
+
+class ScopeShare(Share):
+    """
+    Scope share model associating object permissions with everyone, including
+    anonymous users, or all authenticated users.
+    """
+    scope = models.CharField(
+        max_length=16,
+        choices=SCOPE_CHOICES,
+    )
+
+    class Meta:
+        # Leading scope column also indexes per scope share lookups.
+        unique_together = (
+            ('scope', 'content_type', 'object_id'),
+            ('scope', 'content_type', 'object_pk'),
+        )
+
+    def __unicode__(self):
+        return '%s share' % self.get_scope_display()
+
+class EffectiveShare(Share):
+    """
+    Effective share model combining the permissions of a user's own and group 
+    shares of an object, maintained if the SHARING_EFFECTIVE_SHARES setting is 
+    enabled.
+    """
+    user = models.ForeignKey(
+        'auth.User',
+    )
+
+    class Meta:
+        # Shares valid within a window are kept apart from shares valid
+        # indefinitely, which are combined.
+        unique_together = (
+            ('user', 'content_type', 'object_id', 'valid_from', 'valid_until'),
+            ('user', 'content_type', 'object_pk', 'valid_from', 'valid_until'),
+        )
+
+    def __unicode__(self):
+        return '%s effective share' % self.user
+
+@contextmanager
+def bulk_changes():
+    """
+    Suspend per share cache invalidation and effective share maintenance 
+    while changing shares in bulk. Callers are responsible for invalidating 
+    caches and refreshing effective shares of the changed shares.
+    """
+    _bulk.active = True
+    try:
+        yield
+    finally:
+        _bulk.active = False
+
+@contextmanager
+def deferred_share_cleanup(batch_size=500):
+    """
+    Collect objects deleted within the block, including objects deleted 
+    through cascades, deleting their shares in bulk per model once the block 
+    exits rather than per object. Yields a dict mapping models to the number 
+    of their shares deleted, filled on exit. Nested blocks are cleaned up by 
+    the outermost block.
+    """
+    deleted = {}
+    if getattr(_deferred_cleanup, 'keys', None) is not None:
+        yield deleted
+        return
+    _deferred_cleanup.keys = {}
+    try:
+        yield deleted
+        keys = _deferred_cleanup.keys
+    finally:
+        _deferred_cleanup.keys = None
+    from sharing import utils
+    for model, model_keys in keys.items():
+        if is_content_type_shared(get_content_type(model).id):
+            deleted[model] = utils.delete_object_shares(model, model_keys, batch_size)
+
+def delete_deleted_object_shares(sender, instance, **kwargs):
+    """
+    Delete shares of deleted objects, which generic relations leave behind, 
+    or collect them for deferred_share_cleanup blocks.
+    """
+    if issubclass(sender, Share) or sender._meta.auto_created:
+        return
+    keys = getattr(_deferred_cleanup, 'keys', None)
+    if keys is not None:
+        keys.setdefault(sender, []).append(instance.pk)
+        return
+    # Most deleted objects were never shared.
+    if not is_content_type_shared(get_content_type(sender).id):
+        return
+    from sharing import utils
+    utils.delete_object_shares(sender, [instance.pk])
+
+def is_content_type_shared(content_type_id):
+    """
+    Returns whether or not user, group or scope shares exist for the given 
+    content type, checked with an indexed query per share model. Results are 
+    memoised until shares change within this process, and results without 
+    shares for SHARED_CONTENT_TYPE_TIMEOUT seconds at most, so shares written 
+    by other processes are noticed.
+    """
+    global _shared_content_types_generation
+    if _shared_content_types_generation != cache.generation:
+        _shared_content_types.clear()
+        _shared_content_types_generation = cache.generation
+    entry = _shared_content_types.get(content_type_id)
+    if entry is None or (not entry[0] and entry[1] + SHARED_CONTENT_TYPE_TIMEOUT <= time.time()):
+        shared = False
+        for share_model in (UserShare, GroupShare, ScopeShare):
+            if share_model.objects.filter(content_type=content_type_id).exists():
+                shared = True
+                break
+        entry = _shared_content_types[content_type_id] = (shared, time.time())
+    return entry[0]
+
+def invalidate_user_share_cache(sender, instance, **kwargs):
+    """
+    Invalidate share caches on user share changes.
+    """
+    if not getattr(_bulk, 'active', False):
+        cache.invalidate(user_ids=[instance.user_id])
+
+def invalidate_group_share_cache(sender, instance, **kwargs):
+    """
+    Invalidate share caches on group share changes.
+    """
+    if not getattr(_bulk, 'active', False):
+        cache.invalidate(group_ids=[instance.group_id])
+
+def invalidate_scope_share_cache(sender, instance, **kwargs):
+    """
+    Invalidate share caches on scope share changes.
+    """
+    if not getattr(_bulk, 'active', False):
+        cache.invalidate(scopes=True)
+
+def invalidate_membership_share_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate share caches on group membership changes.
+    """
+    # Members of cleared groups are only known before clearing.
+    if action == 'pre_clear' and reverse:
+        instance._cleared_user_ids = list(instance.user_set.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == 'post_clear':
+        user_ids = instance._cleared_user_ids
+    else:
+        user_ids = pk_set
+    cache.invalidate(user_ids=user_ids)
+
+    from sharing import effective
+    if effective.is_enabled():
+        effective.refresh_users(user_ids)
+
+def refresh_effective_shares(sender, instance, **kwargs):
+    """
+    Refresh effective shares of a share's object on share changes.
+    """
+    from sharing import effective
+    if not effective.is_enabled() or getattr(_bulk, 'active', False):
+        return
+    user_ids = []
+    if sender is UserShare:
+        user_ids.append(instance.user_id)
+    else:
+        user_ids.extend(User.groups.through.objects.filter(
+            group=instance.group_id,
+        ).values_list('user', flat=True))
+    effective.refresh_object(instance.content_type_id, instance.get_object_key(), user_ids)
+
+    # Refresh the previous object if the share was moved.
+    original = getattr(instance, '_original_content_object', None)
+    if original and original != (instance.content_type_id, instance.get_object_key()):
+        effective.refresh_object(*original)
+
+def store_original_content_object(sender, instance, **kwargs):
+    instance._original_content_object = (instance.content_type_id, instance.get_object_key())
+
+signals.post_save.connect(invalidate_group_share_cache, sender=GroupShare)
+signals.post_delete.connect(invalidate_group_share_cache, sender=GroupShare)
+signals.post_save.connect(invalidate_user_share_cache, sender=UserShare)
+signals.post_delete.connect(invalidate_user_share_cache, sender=UserShare)
+signals.post_save.connect(invalidate_scope_share_cache, sender=ScopeShare)
+signals.post_delete.connect(invalidate_scope_share_cache, sender=ScopeShare)
+signals.m2m_changed.connect(invalidate_membership_share_cache, sender=User.groups.through)
+signals.post_delete.connect(delete_deleted_object_shares)
+for share_model in (GroupShare, UserShare):
+    signals.post_init.connect(store_original_content_object, sender=share_model)
+    signals.post_save.connect(refresh_effective_shares, sender=share_model)
+    signals.post_delete.connect(refresh_effective_shares, sender=share_model)
@@ -0,0 +1,45 @@
+import hashlib
+import re
+import time
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db.models.query import QuerySet
+
+# Backends pass times as strings, i.e. '2011-01-01 12:00:00.000000'.
+DATETIME_RE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d+)?$')
+
+class CachedCountQuerySet(QuerySet):
+    """
+    QuerySet caching counts in Django's cache for count_timeout seconds, for 
+    changelists of large share sets where approximate counts suffice. Only 
+    counts are cached, results are always current. Times in queries, i.e. of
+    share validity lookups, are rounded down to count_timeout seconds so 
+    counts are cached across otherwise identical queries.
+    """
+    count_timeout = None
+
+    def count(self):
+        if self._result_cache is not None or not self.count_timeout:
+            return super(CachedCountQuerySet, self).count()
+
+        sql, params = self.query.get_compiler(self.db).as_sql()
+        params = [self._round_param(param) for param in params]
+        key = 'sharing:count:%s' % hashlib.md5(repr((self.db, sql, params))).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = super(CachedCountQuerySet, self).count()
+            cache.set(key, count, self.count_timeout)
+        return count
+
+    def _round_param(self, param):
+        if isinstance(param, basestring) and DATETIME_RE.match(param):
+            param = datetime.strptime(param[:19], '%Y-%m-%d %H:%M:%S')
+        if isinstance(param, datetime):
+            seconds = int(time.mktime(param.timetuple()))
+            return seconds - seconds % self.count_timeout
+        return param
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('count_timeout', self.count_timeout)
+        return super(CachedCountQuerySet, self)._clone(klass, setup, **kwargs)
@@ -0,0 +1,130 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import signals
+
+SHARE_FIELDS = ('can_view', 'can_change', 'can_delete')
+
+# Custom verbs are stored as bits of the share permissions field.
+MAX_VERBS = 31
+
+# Maps models to the foreign key they inherit shares through.
+_inheritance = {}
+
+# Maps models to their custom share verbs, in bit order.
+_verbs = {}
+
+# Resolved permission strings and content types, filled as permissions are 
+# checked so repeated checks skip string parsing and content type lookups.
+_share_fields = {}
+_content_types = {}
+
+def inherit(model, field_name):
+    """
+    Declare that objects of the given model inherit the shares of the object 
+    referenced by the given foreign key, i.e. inherit(Document, 'folder') 
+    grants access to all documents in a folder shared with a user.
+    """
+    model._meta.get_field(field_name)
+    _inheritance[model] = field_name
+
+def get_inheriting_models():
+    """
+    Returns the models declared to inherit shares.
+    """
+    return list(_inheritance.keys())
+
+def get_ancestor_paths(model):
+    """
+    Returns a list of (lookup path, ancestor model) tuples for the models the 
+    given model inherits shares from, following declared inheritance up to 
+    SHARING_INHERITANCE_DEPTH (defaults to 3) levels, i.e. 
+    [('folder', Folder), ('folder__parent', Folder), ...].
+    """
+    paths = []
+    path = None
+    for i in range(getattr(settings, 'SHARING_INHERITANCE_DEPTH', 3)):
+        field_name = _inheritance.get(model)
+        if field_name is None:
+            break
+        path = path and '%s__%s' % (path, field_name) or field_name
+        model = model._meta.get_field(field_name).rel.to
+        paths.append((path, model))
+    return paths
+
+def register_verbs(model, *verbs):
+    """
+    Declare custom permissions shares of the given model can grant besides 
+    view, change and delete, i.e. register_verbs(Article, 'publish', 'approve').
+    Verbs are stored as bits of the share permissions field in order of 
+    registration, so verbs must only ever be appended. Verbs can not contain
+    '_' or '.', which separate permission string parts.
+    """
+    for verb in verbs:
+        if '_' in verb or '.' in verb:
+            raise ValueError("Share verb %s of %s can not contain '_' or '.'." % (verb, model.__name__))
+    model_verbs = _verbs.setdefault(model, [])
+    for verb in verbs:
+        if verb in model_verbs:
+            continue
+        if len(model_verbs) == MAX_VERBS:
+            raise ValueError("%s can not have more than %s share verbs." % (model.__name__, MAX_VERBS))
+        model_verbs.append(verb)
+    _share_fields.clear()
+
+def get_verbs(model):
+    """
+    Returns the custom share verbs of the given model, in bit order.
+    """
+    return _verbs.get(model, [])
+
+def get_verb_mask(model, verbs=None):
+    """
+    Returns the permissions bitmask of the given custom verbs of the given 
+    model, or of all of its verbs if none are given.
+    """
+    model_verbs = get_verbs(model)
+    if verbs is None:
+        verbs = model_verbs
+    mask = 0
+    for verb in verbs:
+        if verb not in model_verbs:
+            raise ValueError("%s is not a share verb of %s." % (verb, model.__name__))
+        mask |= 1 << model_verbs.index(verb)
+    return mask
+
+def get_share_field(perm, model=None):
+    """
+    Resolve a permission string, i.e. 'view' or 'app_label.change_model', to the
+    share field storing it, or to the custom verb of the given model storing 
+    it, i.e. 'publish' for 'app_label.publish_model'. Returns None if shares 
+    do not provide the permission.
+    """
+    try:
+        return _share_fields[(perm, model)]
+    except KeyError:
+        verb = perm.split('.')[-1].split('_')[0]
+        field = 'can_%s' % verb
+        if field not in SHARE_FIELDS:
+            field = verb in get_verbs(model) and verb or None
+        _share_fields[(perm, model)] = field
+        return field
+
+def get_content_type(model):
+    """
+    Returns the content type of the given model or model instance's class.
+    """
+    if not isinstance(model, type):
+        model = model.__class__
+    try:
+        return _content_types[model]
+    except KeyError:
+        content_type = _content_types[model] = ContentType.objects.get_for_model(model)
+        return content_type
+
+def clear_content_types(**kwargs):
+    """
+    Clear resolved content types, i.e. once content types are deleted.
+    """
+    _content_types.clear()
+
+signals.post_delete.connect(clear_content_types, sender=ContentType)
@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent after permission checks and permission limited querysets, if receivers
+# are connected. The number of queries is only known if DEBUG is enabled.
+permission_checked = Signal(providing_args=['source', 'perm', 'content_type', 'cache_hit', 'queries', 'seconds'])
+
+# Sent by SharingStatsMiddleware with a request's aggregated permission stats.
+request_stats = Signal(providing_args=['request', 'stats'])
@@ -0,0 +1,3 @@
+-- Index object lookups, i.e. effective shares of a given object.
+CREATE INDEX sharing_effectiveshare_content_object_id ON sharing_effectiveshare (content_type_id, object_id);
+CREATE INDEX sharing_effectiveshare_content_object_pk ON sharing_effectiveshare (content_type_id, object_pk);
@@ -0,0 +1,108 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from sharing import signals
+
+# Stats of the request being processed on the current thread.
+_current = threading.local()
+
+class Measurement(object):
+    """
+    Measures elapsed time and queries issued by a permission check.
+    """
+    def __init__(self):
+        self.queries = settings.DEBUG and len(connection.queries) or None
+        self.start = time.time()
+
+    def finish(self, sender, source, perm, content_type=None, cache_hit=None):
+        """
+        Sends the permission_checked signal with the measured cost.
+        """
+        seconds = time.time() - self.start
+        queries = None
+        if self.queries is not None:
+            queries = len(connection.queries) - self.queries
+        signals.permission_checked.send(
+            sender=sender,
+            source=source,
+            perm=perm,
+            content_type=content_type,
+            cache_hit=cache_hit,
+            queries=queries,
+            seconds=seconds,
+        )
+
+def measure():
+    """
+    Returns a Measurement if permission_checked receivers are connected, 
+    otherwise None so uninstrumented checks skip measuring.
+    """
+    if signals.permission_checked.receivers:
+        return Measurement()
+    return None
+
+def report_deferred(sender, source, perm, content_type=None):
+    """
+    Sends the permission_checked signal for a check deferred to queryset 
+    evaluation, i.e. by limit_queryset_by_permission, with unknown queries 
+    and seconds. The cost of evaluating share subqueries is part of the 
+    cost of the queryset's own queries.
+    """
+    if signals.permission_checked.receivers:
+        signals.permission_checked.send(
+            sender=sender,
+            source=source,
+            perm=perm,
+            content_type=content_type,
+            cache_hit=None,
+            queries=None,
+            seconds=None,
+        )
+
+class SharingStats(object):
+    """
+    Aggregated cost of a request's permission checks, per source.
+    """
+    def __init__(self):
+        self.checks = 0
+        self.cache_hits = 0
+        self.queries = 0
+        self.seconds = 0.0
+        self.sources = {}
+
+    def add(self, source, cache_hit, queries, seconds):
+        for stats in (self, self.sources.setdefault(source, SharingStats())):
+            stats.checks += 1
+            stats.cache_hits += cache_hit and 1 or 0
+            stats.queries += queries or 0
+            stats.seconds += seconds or 0
+
+    def as_dict(self):
+        return {
+            'checks': self.checks,
+            'cache_hits': self.cache_hits,
+            'queries': self.queries,
+            'seconds': self.seconds,
+            'sources': dict([(source, stats.as_dict()) for source, stats in self.sources.items()]),
+        }
+
+def get_current():
+    """
+    Returns the stats of the request being processed on the current thread,
+    if any.
+    """
+    return getattr(_current, 'stats', None)
+
+def set_current(stats):
+    _current.stats = stats
+
+def collect(sender, source, cache_hit, queries, seconds, **kwargs):
+    """
+    Add permission checks to the stats of the current request.
+    """
+    stats = get_current()
+    if stats is not None:
+        stats.add(source, cache_hit, queries, seconds)
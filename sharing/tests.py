@@ -1,23 +1,76 @@
+from __future__ import with_statement
+
+import re
 import unittest
+from datetime import datetime, timedelta
 
+from django.conf import settings
 from django.contrib import admin
-from django.contrib.auth.models import Group,  User
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth.models import AnonymousUser, Group, Permission, User
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import connection, models
 
-from sharing import utils
-from sharing.admin import ShareAdminMixin
-from sharing.models import GroupShare, UserShare
+from sharing import actions as sharing_actions, cache, effective, registry, signals, utils
+from sharing.backends import SharingBackend
+from sharing.batch import PermissionBatch
+from sharing.managers import SharedManager
+from sharing.middleware import SharingStatsMiddleware
+from sharing.admin import GroupShareInline, ShareAdminMixin, ShareAdminSite, UserSharePkInline
+from sharing.filters import ShareChangeList
+from sharing.models import EffectiveShare, GroupShare, ScopeShare, UserShare, is_content_type_shared
 from snippetscream import RequestFactory
 
 class TestModel(models.Model):
     pass
 models.register_models('sharing', TestModel)
+registry.register_verbs(TestModel, 'publish', 'approve')
+
+class TestPkModel(models.Model):
+    key = models.CharField(max_length=32, primary_key=True)
+models.register_models('sharing', TestPkModel)
+
+class TestFolder(models.Model):
+    parent = models.ForeignKey('self', blank=True, null=True)
+models.register_models('sharing', TestFolder)
+registry.inherit(TestFolder, 'parent')
+
+class TestDocument(models.Model):
+    folder = models.ForeignKey(TestFolder)
+    objects = SharedManager()
+models.register_models('sharing', TestDocument)
+registry.inherit(TestDocument, 'folder')
+
+class PublishedManager(models.Manager):
+    def get_query_set(self):
+        return super(PublishedManager, self).get_query_set().filter(published=True)
+
+class TestPage(models.Model):
+    folder = models.ForeignKey(TestFolder)
+    published = models.BooleanField()
+    objects = PublishedManager()
+models.register_models('sharing', TestPage)
+registry.inherit(TestPage, 'folder')
 
 class TestModelAdmin(ShareAdminMixin, admin.ModelAdmin):
     pass
 admin.site.register(TestModel, TestModelAdmin)
 
+def count_queries(func, *args, **kwargs):
+    """
+    Returns the number of database queries executed by calling func.
+    """
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    try:
+        start = len(connection.queries)
+        func(*args, **kwargs)
+        return len(connection.queries) - start
+    finally:
+        settings.DEBUG = debug
+
 class ShareBackendTestCase(unittest.TestCase):
     def setUp(self):
         # Create test object, users and groups.
@@ -102,6 +155,122 @@ class ShareBackendTestCase(unittest.TestCase):
         # Return True if 'delete' permission is found for group user.
         self.failUnless(self.group_user.has_perm('delete', self.obj))
 
+    def test_has_perm_cache(self):
+        backend = SharingBackend()
+        UserShare.objects.create(
+            user=self.user,
+            can_view=True,
+            content_type=ContentType.objects.get_for_model(self.obj),
+            object_id=self.obj.id,
+        )
+        
+        # Shares are loaded on first check only.
+        self.failUnless(count_queries(backend.has_perm, self.user, 'view', self.obj))
+        self.failIf(count_queries(backend.has_perm, self.user, 'view', self.obj))
+        self.failIf(count_queries(backend.has_perm, self.user, 'change', self.obj))
+        
+        # Share changes invalidate the cache.
+        UserShare.objects.filter(user=self.user).delete()
+        self.failIf(backend.has_perm(self.user, 'view', self.obj))
+        
+        # Group membership changes invalidate the cache.
+        GroupShare.objects.create(
+            group=self.group,
+            can_view=True,
+            content_type=ContentType.objects.get_for_model(self.obj),
+            object_id=self.obj.id,
+        )
+        self.failIf(backend.has_perm(self.user, 'view', self.obj))
+        self.user.groups.add(self.group)
+        self.failUnless(backend.has_perm(self.user, 'view', self.obj))
+
+    def test_has_perm_shared_cache(self):
+        settings.SHARING_CACHE = True
+        try:
+            backend = SharingBackend()
+            content_type = ContentType.objects.get_for_model(self.obj)
+            share = UserShare.objects.create(
+                user=self.user,
+                can_view=True,
+                content_type=content_type,
+                object_id=self.obj.id,
+            )
+            
+            # Shares resolved in one process are reused by others.
+            num_queries = count_queries(backend.has_perm, User.objects.get(pk=self.user.pk), 'view', self.obj)
+            self.failUnless(count_queries(backend.has_perm, User.objects.get(pk=self.user.pk), 'view', self.obj) < num_queries)
+            self.failUnless(backend.has_perm(User.objects.get(pk=self.user.pk), 'view', self.obj))
+            
+            # Revoked user shares are never served from the cache.
+            share.delete()
+            self.failIf(backend.has_perm(User.objects.get(pk=self.user.pk), 'view', self.obj))
+            
+            # Revoked group shares are never served from the cache.
+            group_share = GroupShare.objects.create(
+                group=self.group,
+                can_view=True,
+                content_type=content_type,
+                object_id=self.obj.id,
+            )
+            self.failUnless(backend.has_perm(User.objects.get(pk=self.group_user.pk), 'view', self.obj))
+            group_share.can_view = False
+            group_share.save()
+            self.failIf(backend.has_perm(User.objects.get(pk=self.group_user.pk), 'view', self.obj))
+            
+            # Group membership changes are never served from the cache.
+            group_share.can_view = True
+            group_share.save()
+            self.failUnless(backend.has_perm(User.objects.get(pk=self.group_user.pk), 'view', self.obj))
+            self.group.user_set.clear()
+            self.failIf(backend.has_perm(User.objects.get(pk=self.group_user.pk), 'view', self.obj))
+            
+            # Bulk changes bump versions again once committed.
+            cache.bump_pending_versions()
+            utils.grant_shares([(self.user, self.obj)], can_view=True)
+            self.failIf(cache._pending.keys)
+            self.failUnless(backend.has_perm(User.objects.get(pk=self.user.pk), 'view', self.obj))
+        finally:
+            settings.SHARING_CACHE = False
+
+    def test_has_perm_instrumentation(self):
+        checks = []
+        def receiver(sender, **kwargs):
+            checks.append(kwargs)
+        signals.permission_checked.connect(receiver)
+        try:
+            # Checks report their permission and cache usage.
+            backend = SharingBackend()
+            backend.has_perm(self.user, 'view', self.obj)
+            backend.has_perm(self.user, 'view', self.obj)
+            self.failUnlessEqual([check['source'] for check in checks], ['has_perm', 'has_perm'])
+            self.failUnlessEqual([check['cache_hit'] for check in checks], [False, True])
+            self.failUnlessEqual(checks[0]['content_type'], ContentType.objects.get_for_model(self.obj))
+            
+            # Lazily filtered querysets report checks of unknown cost.
+            utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', self.user)
+            self.failUnlessEqual(checks[-1]['source'], 'limit_queryset_by_permission')
+            self.failUnlessEqual((checks[-1]['queries'], checks[-1]['seconds']), (None, None))
+        finally:
+            signals.permission_checked.disconnect(receiver)
+
+    def test_stats_middleware(self):
+        middleware = SharingStatsMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        self.user.has_perm('view', self.obj)
+        utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', self.user)
+        middleware.process_response(request, None)
+        
+        # Checks are aggregated per request and source.
+        self.user.has_perm('view', self.obj)
+        self.failUnlessEqual(request.sharing_stats.checks, 2)
+        self.failUnlessEqual(request.sharing_stats.sources['has_perm'].checks, 1)
+        self.failUnlessEqual(request.sharing_stats.sources['limit_queryset_by_permission'].checks, 1)
+        self.failUnlessEqual(request.sharing_stats.sources['limit_queryset_by_permission'].queries, 0)
+
+class TestModelCachedCountAdmin(TestModelAdmin):
+    share_count_cache_timeout = 60
+
 class ShareAdminTestCase(unittest.TestCase):
     def setUp(self):
         # Create test object, users, groups, admin object and request.
@@ -181,6 +350,62 @@ class ShareAdminTestCase(unittest.TestCase):
         )
         self.failUnless(self.share_admin.has_delete_permission(self.request, self.obj))
 
+    def test_share_inline_unique_principals(self):
+        formset_class = GroupShareInline(TestModel, admin.site).get_formset(self.request, self.obj)
+        prefix = formset_class.get_default_prefix()
+        data = {
+            prefix + '-TOTAL_FORMS': '2',
+            prefix + '-INITIAL_FORMS': '0',
+            prefix + '-0-group': str(self.group.id),
+            prefix + '-0-can_view': 'on',
+            prefix + '-1-group': str(self.group.id),
+            prefix + '-1-can_change': 'on',
+        }
+        
+        # Sharing with the same group twice is invalid.
+        self.failIf(formset_class(data, instance=self.obj).is_valid())
+        
+        # Sharing with a group once is valid.
+        data[prefix + '-TOTAL_FORMS'] = '1'
+        self.failUnless(formset_class(data, instance=self.obj).is_valid())
+
+    def test_share_inline_queries(self):
+        inline = GroupShareInline(TestModel, admin.site)
+        def render():
+            formset_class = inline.get_formset(self.request, self.obj)
+            formset = formset_class(instance=self.obj, queryset=inline.queryset(self.request))
+            for form in formset.initial_forms:
+                unicode(form.instance)
+            for form in formset.forms:
+                unicode(form)
+        
+        # Rendering takes a fixed number of queries regardless of shares.
+        utils.grant_shares([(self.group, self.obj)], can_view=True)
+        queries = count_queries(render)
+        groups = [Group.objects.create(name='group-%s' % i) for i in range(3)]
+        utils.grant_shares([(group, self.obj) for group in groups], can_view=True)
+        self.failUnlessEqual(count_queries(render), queries)
+        utils.revoke_shares([(group, self.obj) for group in groups + [self.group]])
+        for group in groups:
+            group.delete()
+
+    def test_formfield_for_foreignkey(self):
+        self.request.user = self.user
+        self.user.is_staff = True
+        self.user.save()
+        share_admin = TestModelAdmin(UserShare, admin.site)
+        db_field = UserShare._meta.get_field('user')
+        ContentType.objects.get_for_model(User)
+        
+        # Building the field should not hit the database.
+        self.failIf(count_queries(share_admin.formfield_for_foreignkey, db_field, self.request))
+        field = share_admin.formfield_for_foreignkey(db_field, self.request)
+        self.failUnless(field.queryset._result_cache is None)
+        
+        # Only viewable objects are valid choices.
+        self.failUnlessEqual(field.clean(self.user.pk), self.user)
+        self.assertRaises(ValidationError, field.clean, self.group_user.pk)
+
     def test_queryset(self):
         # Anonymous user should always have an empty queryset
         self.failIf(self.share_admin.queryset(self.request))
@@ -211,6 +436,134 @@ class ShareAdminTestCase(unittest.TestCase):
         )
         self.failUnless(self.obj in self.share_admin.queryset(self.request))
 
+    def test_queryset_cached_count(self):
+        self.request.user = self.user
+        share_admin = TestModelCachedCountAdmin(TestModel, admin.site)
+        UserShare.objects.create(
+            user=self.user,
+            can_view=True,
+            content_type=ContentType.objects.get_for_model(self.obj),
+            object_id=self.obj.id,
+        )
+        
+        # Counts are cached, also for filtered querysets.
+        self.failUnlessEqual(share_admin.queryset(self.request).filter(id__gt=0).count(), 1)
+        self.failIf(count_queries(share_admin.queryset(self.request).filter(id__gt=0).count))
+        
+        # Results are always current.
+        obj = TestModel.objects.create(id=2)
+        utils.grant_shares([(self.user, obj)], can_view=True)
+        self.failUnlessEqual(share_admin.queryset(self.request).filter(id__gt=0).count(), 1)
+        self.failUnlessEqual(len(share_admin.queryset(self.request).filter(id__gt=0)), 2)
+        obj.delete()
+
+    def test_share_admin_site(self):
+        # Sharing applies to admin classes as models are registered.
+        site = ShareAdminSite()
+        site.register(TestModel)
+        site.register(TestPkModel, TestModelAdmin)
+        self.failUnless(isinstance(site._registry[TestModel], ShareAdminMixin))
+        self.failUnless(site._registry[TestPkModel].__class__ is TestModelAdmin)
+        
+        # Share admin classes are created once per admin class.
+        other_site = ShareAdminSite()
+        other_site.register(TestModel)
+        self.failUnless(site._registry[TestModel].__class__ is other_site._registry[TestModel].__class__)
+        
+        # Sharing can be limited to models registered with share=True.
+        site = ShareAdminSite(share_all=False)
+        site.register(TestModel)
+        site.register(TestPkModel, share=True)
+        self.failIf(isinstance(site._registry[TestModel], ShareAdminMixin))
+        self.failUnless(isinstance(site._registry[TestPkModel], ShareAdminMixin))
+        
+        # ChangeList classes of admin classes are kept.
+        class CustomChangeList(ChangeList):
+            pass
+        class CustomAdmin(admin.ModelAdmin):
+            def get_changelist(self, request, **kwargs):
+                return CustomChangeList
+        site = ShareAdminSite()
+        site.register(TestModel, CustomAdmin)
+        changelist_class = site._registry[TestModel].get_changelist(self.request)
+        self.failUnless(issubclass(changelist_class, CustomChangeList))
+        self.failUnless(issubclass(changelist_class, ShareChangeList))
+
+    def test_actions(self):
+        obj = TestModel.objects.create(id=2)
+        self.user.user_permissions.add(Permission.objects.get(codename='delete_testmodel'))
+        self.user.groups.add(self.group)
+        utils.grant_shares([(self.user, self.obj)], can_view=True, can_change=True, can_delete=True)
+        utils.grant_shares([(self.user, obj)], can_view=True)
+        self.request.user = User.objects.get(pk=self.user.pk)
+        actions = self.share_admin.get_actions(self.request)
+        queryset = TestModel.objects.filter(id__in=[1, 2])
+        
+        # Selected objects are limited to those the user may change.
+        actions['share_with_group_%s' % self.group.pk][0](self.share_admin, self.request, queryset)
+        self.failUnless(GroupShare.objects.filter(group=self.group, object_id=self.obj.id, can_view=True))
+        self.failIf(GroupShare.objects.filter(group=self.group, object_id=obj.id))
+        
+        # Selected objects are limited to those the user may delete.
+        self.failUnlessEqual(actions['delete_selected'][0], sharing_actions.delete_selected)
+        self.failUnlessEqual(list(sharing_actions.limit_selected(self.share_admin, self.request, 
+                queryset, 'delete')), [self.obj])
+        
+        # Skipped objects are reported on confirmation, which only posts back
+        # the objects the user may delete. Objects of models registered with 
+        # the site would link to their admin URLs.
+        messages = []
+        share_admin = TestModelAdmin(TestModel, admin.AdminSite())
+        share_admin.message_user = lambda request, message: messages.append(message)
+        try:
+            response = sharing_actions.delete_selected(share_admin, self.request, queryset)
+            self.failUnlessEqual(messages, ['Skipped 1 test model you do not have permission to delete.'])
+            selected = re.findall(r'name="_selected_action" value="([^"]+)"', response.content)
+            self.failUnlessEqual(selected, [str(self.obj.id)])
+            request = RequestFactory().post('/', {'post': 'yes', '_selected_action': selected})
+            request.user = self.request.user
+            sharing_actions.delete_selected(share_admin, request, TestModel.objects.filter(pk__in=selected))
+            self.failUnlessEqual(len(messages), 2)
+            self.failUnless(messages[1].startswith('Successfully deleted'))
+            self.failIf(TestModel.objects.filter(id=self.obj.id))
+        finally:
+            obj.delete()
+
+    def test_changelist_filters(self):
+        def changelist(**params):
+            request = RequestFactory().get('/', params)
+            request.user = User.objects.get(pk=self.user.pk)
+            share_admin = self.share_admin
+            return share_admin.get_changelist(request)(request, TestModel, ('action_checkbox', 'share_sources'),
+                    share_admin.list_display_links, share_admin.list_filter, share_admin.date_hierarchy,
+                    share_admin.search_fields, share_admin.list_select_related, share_admin.list_per_page,
+                    share_admin.list_editable, share_admin)
+        objs = [self.obj, TestModel.objects.create(id=2), TestModel.objects.create(id=3)]
+        self.user.groups.add(self.group)
+        utils.grant_shares([(self.user, objs[0])], can_view=True, can_change=True, can_delete=True)
+        utils.grant_shares([(self.user, objs[1]), (self.group, objs[1]), (self.group, objs[2])], can_view=True)
+        
+        # Objects are filtered by how they are shared with the user.
+        self.failUnlessEqual(list(changelist().result_list), objs[::-1])
+        self.failUnlessEqual(list(changelist(shared='me').result_list), objs[1::-1])
+        self.failUnlessEqual(list(changelist(shared='owned').result_list), objs[:1])
+        self.failUnlessEqual(list(changelist(shared=str(self.group.pk)).result_list), objs[:0:-1])
+        self.failUnlessRaises(IncorrectLookupParameters, changelist, shared='0')
+        cl = changelist(shared='me')
+        self.failUnlessEqual([(choice['display'], choice['selected']) for choice in cl.filter_specs[-1].choices(cl)],
+                [('All', False), ('Shared with me', True), ('Owned by me', False), ('Shared with group', False)])
+        
+        # Share sources are resolved for all listed objects at once.
+        cl = changelist()
+        self.failUnlessEqual([self.share_admin.share_sources(obj) for obj in cl.result_list], 
+                ['group', 'Me, group', 'Me'])
+        num_queries = count_queries(changelist)
+        utils.grant_shares([('public', obj) for obj in objs], can_view=True)
+        self.failUnlessEqual(num_queries, count_queries(changelist))
+        ScopeShare.objects.all().delete()
+        for obj in objs[1:]:
+            obj.delete()
+
 class UtilsTestCase(unittest.TestCase):
     def setUp(self):
         # Create test object, users and groups.
@@ -304,3 +657,534 @@ class UtilsTestCase(unittest.TestCase):
         self.failIf(self.user in utils.limit_queryset_by_permission(User.objects.all(), 'view', self.group_user))
         self.failIf(self.user in utils.limit_queryset_by_permission(User.objects.all(), 'change', self.group_user))
         self.failIf(self.user in utils.limit_queryset_by_permission(User.objects.all(), 'delete', self.group_user))
+
+    def test_share_verbs(self):
+        def can(user, perm):
+            return self.obj in utils.limit_queryset_by_permission(TestModel.objects.all(), perm, user) and \
+                    User.objects.get(pk=user.pk).has_perm(perm, self.obj)
+        
+        # Custom verbs are granted per principal.
+        utils.grant_shares([(self.user, self.obj)], can_view=True, verbs=['publish'])
+        utils.grant_shares([(self.group, self.obj)], verbs=['approve'])
+        self.failUnless(can(self.user, 'publish'))
+        self.failUnless(can(self.user, 'sharing.publish_testmodel'))
+        self.failIf(can(self.user, 'approve'))
+        self.failUnless(can(self.group_user, 'approve'))
+        self.failIf(can(self.group_user, 'publish'))
+        self.failUnlessEqual(UserShare.objects.get(user=self.user).permissions, 1)
+        
+        # Verbs must be registered for the model.
+        self.failIf(can(self.user, 'export'))
+        self.failUnlessRaises(ValueError, utils.grant_shares, [(self.user, self.obj)], verbs=['export'])
+        
+        # Verbs can not contain permission string separators.
+        self.failUnlessRaises(ValueError, registry.register_verbs, TestModel, 'mark_reviewed')
+        self.failUnlessRaises(ValueError, registry.register_verbs, TestModel, 'mark.reviewed')
+        self.failUnlessEqual(registry.get_verbs(TestModel), ['publish', 'approve'])
+        
+        # Revoking verbs keeps other permissions, deleting empty shares.
+        self.failUnlessEqual(utils.revoke_shares([(self.user, self.obj), (self.group, self.obj)], 
+                verbs=['publish', 'approve']), 1)
+        self.failIf(can(self.user, 'publish'))
+        self.failIf(can(self.group_user, 'approve'))
+        self.failUnless(can(self.user, 'view'))
+        self.failUnlessEqual(utils.revoke_shares([(self.user, self.obj)]), 1)
+
+    def test_share_validity(self):
+        backend = SharingBackend()
+        def can_view(user):
+            return self.obj in utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', user) and \
+                    backend.has_perm(user, 'view', self.obj)
+        now = datetime.now()
+        share = UserShare.objects.create(
+            user=self.user,
+            can_view=True,
+            content_type=ContentType.objects.get_for_model(self.obj),
+            object_id=self.obj.id,
+            valid_until=now - timedelta(days=1),
+        )
+        
+        # Expired and not yet valid shares grant nothing.
+        self.failIf(can_view(self.user))
+        share.valid_until = None
+        share.valid_from = now + timedelta(days=1)
+        share.save()
+        self.failIf(can_view(self.user))
+        
+        # Shares are valid within their window, cached until they expire.
+        share.valid_from = now - timedelta(days=1)
+        share.valid_until = now + timedelta(days=1)
+        share.save()
+        self.failUnless(can_view(self.user))
+        content_type = ContentType.objects.get_for_model(self.obj)
+        shares, expires = backend.get_share_entry(self.user, content_type)
+        self.failUnlessEqual(expires, share.valid_until)
+        
+        # Expired cache entries are reloaded, here once expiry is reached 
+        # without invalidating caches.
+        UserShare.objects.filter(pk=share.pk).update(valid_until=now)
+        backend.get_cache(self.user)[content_type.id] = (shares, now)
+        self.failIf(can_view(self.user))
+        
+        # Expired shares are purged.
+        GroupShare.objects.create(
+            group=self.group,
+            can_view=True,
+            content_type=ContentType.objects.get_for_model(self.obj),
+            object_id=self.obj.id,
+        )
+        self.failUnlessEqual(utils.purge_expired_shares(UserShare, batch_size=1), 1)
+        self.failUnlessEqual(utils.purge_expired_shares(GroupShare, batch_size=1), 0)
+        GroupShare.objects.all().delete()
+        
+        # Granting renews shares outside of their window.
+        share = UserShare.objects.create(
+            user=self.user,
+            can_view=True,
+            content_type=ContentType.objects.get_for_model(self.obj),
+            object_id=self.obj.id,
+            valid_until=now - timedelta(days=1),
+        )
+        self.failUnlessEqual(utils.grant_shares([(self.user, self.obj)], can_view=True), 0)
+        self.failUnless(can_view(self.user))
+        
+        # So does saving objects in the admin, granting full shares.
+        share.save()
+        self.failIf(can_view(self.user))
+        request = RequestFactory().post('/')
+        request.user = self.user
+        TestModelAdmin(TestModel, admin.site).save_model(request, self.obj, None, True)
+        self.failUnless(backend.has_perm(self.user, 'delete', self.obj))
+        UserShare.objects.all().delete()
+
+    def test_has_perms_for_objects(self):
+        objs = [self.obj, TestModel.objects.create(id=2), self.group_user]
+        
+        # No permissions without shares.
+        self.failIf(True in utils.has_perms_for_objects(self.user, 'view', objs).values())
+        
+        # Mixed content types resolve from their own shares.
+        for obj in (self.obj, self.group_user):
+            UserShare.objects.create(
+                user=self.user,
+                can_view=True,
+                content_type=ContentType.objects.get_for_model(obj),
+                object_id=obj.id,
+            )
+        perms = utils.has_perms_for_objects(self.user, 'view', objs)
+        self.failUnless(perms[self.obj])
+        self.failIf(perms[objs[1]])
+        self.failUnless(perms[self.group_user])
+        self.failIf(True in utils.has_perms_for_objects(self.user, 'change', objs).values())
+       
+        # Query count does not depend on the number of objects.
+        self.user = User.objects.get(pk=self.user.pk)
+        num_queries = count_queries(utils.has_perms_for_objects, self.user, 'view', objs[:1])
+        self.user = User.objects.get(pk=self.user.pk)
+        self.failUnlessEqual(num_queries, count_queries(utils.has_perms_for_objects, self.user, 'view', objs[:2]))
+        objs[1].delete()
+        
+    def test_grant_and_revoke_shares(self):
+        objs = [self.obj, TestModel.objects.create(id=2)]
+        
+        # Shares are created for missing pairs, duplicates skipped.
+        shares = [(self.user, obj) for obj in objs] + [(self.group, obj) for obj in objs]
+        self.failUnlessEqual(utils.grant_shares(shares + shares[:1], can_view=True), 4)
+        self.failUnless(self.user.has_perm('view', objs[1]))
+        self.failUnless(self.group_user.has_perm('view', objs[1]))
+        self.failIf(self.user.has_perm('change', objs[1]))
+        
+        # Existing shares are updated.
+        self.failUnlessEqual(utils.grant_shares(shares[:1], can_change=True), 0)
+        self.failUnless(self.user.has_perm('change', self.obj))
+        self.failUnless(self.user.has_perm('view', self.obj))
+        
+        # Revoked permissions are removed, shares without permissions deleted.
+        self.failUnlessEqual(utils.revoke_shares(shares[:1], can_view=True), 0)
+        self.failIf(self.user.has_perm('view', self.obj))
+        self.failUnless(self.user.has_perm('change', self.obj))
+        self.failUnlessEqual(utils.revoke_shares(shares), 4)
+        self.failIf(self.group_user.has_perm('view', objs[1]))
+        self.failIf(UserShare.objects.count() or GroupShare.objects.count())
+        objs[1].delete()
+
+    def test_scope_shares(self):
+        anonymous = AnonymousUser()
+        def can_view(user):
+            return self.obj in utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', user) and \
+                    user.has_perm('view', self.obj)
+        
+        # Authenticated shares apply to all active users, but not anonymous ones.
+        self.failUnlessEqual(utils.grant_shares([('authenticated', self.obj)], can_view=True), 1)
+        self.failUnless(can_view(self.user))
+        self.failUnless(can_view(self.group_user))
+        self.failIf(can_view(anonymous))
+        self.failUnlessEqual(set(utils.users_with_perm(self.obj, 'view')), set(User.objects.filter(is_active=True)))
+        
+        # Public shares apply to anonymous users as well, without per user rows.
+        utils.grant_shares([('public', self.obj)], can_view=True)
+        self.failUnless(can_view(anonymous))
+        self.failUnlessEqual(list(utils.objects_for_user(anonymous)), [self.obj])
+        self.failIf(UserShare.objects.count() or EffectiveShare.objects.count())
+        
+        # Revoking scope shares applies immediately.
+        self.failUnlessEqual(utils.revoke_shares([('public', self.obj)], can_view=True), 1)
+        self.failIf(can_view(anonymous))
+        self.failUnless(can_view(self.user))
+        ScopeShare.objects.all().delete()
+        self.failIf(can_view(User.objects.get(pk=self.user.pk)))
+        
+        # Unknown scopes are rejected.
+        self.failUnlessRaises(ValueError, utils.grant_shares, [('everyone', self.obj)], can_view=True)
+
+    def test_deleted_object_shares(self):
+        def shares():
+            return [share_model.objects.filter(object_id=2).count() for share_model in (UserShare, GroupShare, ScopeShare)]
+        obj = TestModel.objects.create(id=2)
+        utils.grant_shares([(self.user, obj), (self.group, obj), ('public', obj)], can_view=True)
+        self.failUnless(self.group_user.has_perm('view', obj))
+        
+        # Shares are deleted along with their object, and caches invalidated.
+        obj.delete()
+        self.failUnlessEqual(shares(), [0, 0, 0])
+        obj = TestModel.objects.create(id=2)
+        self.failIf(self.group_user.has_perm('view', obj))
+        
+        # Shares of deleted querysets are deleted in bulk.
+        utils.grant_shares([(self.user, obj), (self.group, obj), ('public', obj)], can_view=True)
+        self.failUnlessEqual(utils.delete_queryset(TestModel.objects.filter(id=2)), 3)
+        self.failUnlessEqual(shares(), [0, 0, 0])
+        self.failUnless(TestModel.objects.filter(id=self.obj.id))
+        
+        # Shares of objects deleted through cascades are deleted too.
+        folder = TestFolder.objects.create()
+        document = TestDocument.objects.create(folder=folder)
+        utils.grant_shares([(self.user, folder), (self.group, document)], can_view=True)
+        self.failUnlessEqual(utils.delete_queryset(TestFolder.objects.filter(pk=folder.pk)), 2)
+        self.failIf(GroupShare.objects.filter(content_type=ContentType.objects.get_for_model(TestDocument)))
+        
+        # Deleting objects of content types never shared queries no shares.
+        permissions = [Permission.objects.create(name='Unshared %s' % i, codename='unshared_%s' % i,
+                content_type=ContentType.objects.get_for_model(TestModel)) for i in range(5)]
+        self.failIf(is_content_type_shared(ContentType.objects.get_for_model(Permission).id))
+        settings.DEBUG = True
+        try:
+            start = len(connection.queries)
+            for permission in permissions:
+                permission.delete()
+            self.failIf([query for query in connection.queries[start:] if 'sharing_' in query['sql']])
+        finally:
+            settings.DEBUG = False
+        
+        # Content types are checked again once shares change.
+        permission = Permission.objects.create(name='Shared', codename='shared',
+                content_type=ContentType.objects.get_for_model(TestModel))
+        utils.grant_shares([(self.user, permission)], can_view=True)
+        self.failUnless(is_content_type_shared(ContentType.objects.get_for_model(Permission).id))
+        permission.delete()
+        self.failIf(UserShare.objects.filter(content_type=ContentType.objects.get_for_model(Permission)))
+        
+        # Orphaned shares are purged in batches, resuming after the last share.
+        obj = TestModel(id=2)
+        utils.grant_shares([(self.user, self.obj), (self.user, obj), (self.group_user, obj)], can_view=True)
+        content_type_id = ContentType.objects.get_for_model(TestModel).id
+        progress = list(utils.purge_orphaned_shares(UserShare, content_type_id, batch_size=2))
+        self.failUnlessEqual([deleted for last_id, deleted in progress], [1, 1])
+        self.failUnlessEqual(shares(), [0, 0, 0])
+        self.failUnless(UserShare.objects.filter(object_id=self.obj.id))
+        self.failIf(list(utils.purge_orphaned_shares(UserShare, content_type_id, after_id=progress[-1][0])))
+
+    def test_permission_batch(self):
+        objs = [self.obj, TestModel.objects.create(id=2), self.group_user]
+        UserShare.objects.create(
+            user=self.user,
+            can_view=True,
+            content_type=ContentType.objects.get_for_model(self.obj),
+            object_id=self.obj.id,
+        )
+        
+        # Checks are deferred until evaluated.
+        batch = PermissionBatch(User.objects.get(pk=self.user.pk))
+        results = [batch.check('view', obj) for obj in objs]
+        self.failUnlessEqual(len(batch.pending['view']), 3)
+        
+        # Evaluating a check resolves all pending checks.
+        self.failUnless(results[0])
+        self.failIf(batch.pending)
+        self.failIf(count_queries(lambda: [bool(result) for result in results]))
+        self.failUnlessEqual([bool(result) for result in results], [True, False, False])
+        self.failIf(batch.has_perm('change', self.obj))
+        objs[1].delete()
+
+    def test_registry_resolution(self):
+        # Permission strings resolve to share fields.
+        self.failUnlessEqual(registry.get_share_field('view'), 'can_view')
+        self.failUnlessEqual(registry.get_share_field('sharing.change_testmodel'), 'can_change')
+        self.failUnlessEqual(registry.get_share_field('sharing.add_testmodel'), None)
+        
+        # Content types resolve once per model.
+        content_type = registry.get_content_type(self.obj)
+        self.failUnlessEqual(content_type, ContentType.objects.get_for_model(TestModel))
+        ContentType.objects.clear_cache()
+        self.failIf(count_queries(registry.get_content_type, TestModel))
+
+    def test_limit_queryset_by_permission_is_lazy(self):
+        # Filtering should not evaluate the queryset.
+        qs = utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', self.user)
+        self.failUnless(qs._result_cache is None)
+
+    def test_limit_queryset_by_permission_superuser(self):
+        # Active superusers can access all objects.
+        self.user.is_superuser = True
+        self.user.save()
+        self.failUnless(self.obj in utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', self.user))
+        
+        # Inactive users can only access themselves.
+        self.user.is_active = False
+        self.user.save()
+        self.failIf(utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', self.user))
+        self.failUnless(self.user in utils.limit_queryset_by_permission(User.objects.all(), 'view', self.user))
+
+class EffectiveShareTestCase(unittest.TestCase):
+    def setUp(self):
+        # Create test object, users and groups, enabling effective shares.
+        settings.SHARING_EFFECTIVE_SHARES = True
+        self.obj = TestModel.objects.create(id=1)
+        self.user = User.objects.create(username='user')
+        self.group = Group.objects.create(name='group')
+        self.group_user = User.objects.create(username='group_user')
+        self.group_user.groups.add(self.group)
+        self.group_user.save()
+    
+    def tearDown(self):
+        # Delete created objects.
+        settings.SHARING_EFFECTIVE_SHARES = False
+        self.obj.delete()
+        self.user.delete()
+        self.group.delete()
+        self.group_user.delete()
+
+    def can_view(self, user):
+        return self.obj in utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', user) and \
+                SharingBackend().has_perm(user, 'view', self.obj)
+
+    def test_effective_shares(self):
+        content_type = ContentType.objects.get_for_model(self.obj)
+        
+        # User shares are reflected.
+        user_share = UserShare.objects.create(
+            user=self.user,
+            can_view=True,
+            content_type=content_type,
+            object_id=self.obj.id,
+        )
+        self.failUnless(self.can_view(self.user))
+        self.failIf(self.can_view(self.group_user))
+        
+        # Group shares are reflected for group members.
+        group_share = GroupShare.objects.create(
+            group=self.group,
+            can_view=True,
+            content_type=content_type,
+            object_id=self.obj.id,
+        )
+        self.failUnless(self.can_view(self.group_user))
+        
+        # Group membership changes are reflected.
+        self.group.user_set.add(self.user)
+        user_share.delete()
+        self.failUnless(self.can_view(self.user))
+        self.user.groups.remove(self.group)
+        self.failIf(self.can_view(self.user))
+        self.group.user_set.clear()
+        self.failIf(self.can_view(self.group_user))
+        self.group_user.groups.add(self.group)
+        self.failUnless(self.can_view(self.group_user))
+        
+        # Group share revocations are reflected.
+        group_share.can_view = False
+        group_share.save()
+        self.failIf(self.can_view(self.group_user))
+        
+        # Rebuilding restores effective shares.
+        group_share.can_view = True
+        group_share.save()
+        EffectiveShare.objects.all().delete()
+        self.failIf(self.can_view(self.group_user))
+        effective.rebuild()
+        self.failUnless(self.can_view(self.group_user))
+        self.failUnlessEqual(EffectiveShare.objects.count(), 1)
+        
+        # Members of large groups are refreshed in batches.
+        self.group.user_set.add(self.user)
+        EffectiveShare.objects.all().delete()
+        effective.refresh_objects(content_type.id, [self.obj.id], [self.user.id, self.group_user.id], batch_size=1)
+        self.failUnlessEqual(set(EffectiveShare.objects.values_list('user', flat=True)), 
+                set([self.user.id, self.group_user.id]))
+
+    def test_effective_share_verbs(self):
+        # Custom verbs of user and group shares are combined.
+        utils.grant_shares([(self.group_user, self.obj)], verbs=['publish'])
+        utils.grant_shares([(self.group, self.obj)], verbs=['approve'])
+        self.failUnlessEqual(EffectiveShare.objects.get(user=self.group_user).permissions, 3)
+        user = User.objects.get(pk=self.group_user.pk)
+        self.failUnless(user.has_perm('approve', self.obj))
+        self.failUnless(self.obj in utils.limit_queryset_by_permission(TestModel.objects.all(), 'publish', user))
+        self.failUnlessEqual(list(utils.users_with_perm(self.obj, 'approve')), [self.group_user])
+        self.failUnlessEqual(list(utils.objects_for_user(self.group_user, 'publish')), [self.obj])
+        utils.revoke_shares([(self.group_user, self.obj), (self.group, self.obj)])
+        self.failIf(EffectiveShare.objects.all())
+
+    def test_effective_share_validity(self):
+        content_type = ContentType.objects.get_for_model(self.obj)
+        
+        # Shares valid within a window are kept apart from other shares.
+        GroupShare.objects.create(
+            group=self.group,
+            can_view=True,
+            content_type=content_type,
+            object_id=self.obj.id,
+            valid_until=datetime.now() - timedelta(days=1),
+        )
+        UserShare.objects.create(
+            user=self.group_user,
+            can_change=True,
+            content_type=content_type,
+            object_id=self.obj.id,
+        )
+        self.failIf(self.can_view(self.group_user))
+        GroupShare.objects.update(valid_until=datetime.now() + timedelta(days=1))
+        effective.rebuild()
+        self.failUnless(self.can_view(User.objects.get(pk=self.group_user.pk)))
+        self.failUnlessEqual(EffectiveShare.objects.count(), 2)
+        GroupShare.objects.all().delete()
+        UserShare.objects.all().delete()
+
+class NonIntegerPkTestCase(unittest.TestCase):
+    def setUp(self):
+        # Create test object with a non-integer primary key, users and groups.
+        self.obj = TestPkModel.objects.create(key='a1')
+        self.user = User.objects.create(username='user')
+        self.group = Group.objects.create(name='group')
+        self.group_user = User.objects.create(username='group_user')
+        self.group_user.groups.add(self.group)
+        self.group_user.save()
+    
+    def tearDown(self):
+        # Delete created objects.
+        self.obj.delete()
+        self.user.delete()
+        self.group.delete()
+        self.group_user.delete()
+
+    def test_shares(self):
+        # Shares store non-integer primary keys in object_pk.
+        utils.grant_shares([(self.user, self.obj), (self.group, self.obj)], can_view=True)
+        self.failUnlessEqual(UserShare.objects.get(user=self.user).object_pk, 'a1')
+        self.failUnlessEqual(UserShare.objects.get(user=self.user).content_object_by_pk, self.obj)
+
+        self.failUnless(self.user.has_perm('view', self.obj))
+        self.failUnless(self.group_user.has_perm('view', self.obj))
+        self.failIf(self.user.has_perm('change', self.obj))
+        self.failUnless(self.obj in utils.limit_queryset_by_permission(TestPkModel.objects.all(), 'view', self.user))
+        self.failUnless(self.obj in utils.limit_queryset_by_permission(TestPkModel.objects.all(), 'view', self.group_user))
+        self.failIf(utils.limit_queryset_by_permission(TestPkModel.objects.all(), 'change', self.user))
+
+        # Object pks do not match object ids of other objects.
+        TestModel.objects.create(id=1)
+        self.failIf(utils.limit_queryset_by_permission(TestModel.objects.all(), 'view', self.user))
+        TestModel.objects.all().delete()
+        utils.revoke_shares([(self.user, self.obj), (self.group, self.obj)])
+
+    def test_admin_inlines(self):
+        # Share inlines relate through object_pk.
+        share_admin = TestModelAdmin(TestPkModel, admin.site)
+        self.failUnless(UserSharePkInline in share_admin.inlines)
+        
+        # Shares saved through inlines store the object's primary key.
+        self.user.is_staff = True
+        self.user.save()
+        request = RequestFactory().get('/')
+        formset_class = UserSharePkInline(TestPkModel, admin.site).get_formset(request, self.obj)
+        prefix = formset_class.get_default_prefix()
+        formset = formset_class({
+            prefix + '-TOTAL_FORMS': '1',
+            prefix + '-INITIAL_FORMS': '0',
+            prefix + '-0-user': str(self.user.id),
+            prefix + '-0-can_view': 'on',
+        }, instance=self.obj)
+        self.failUnless(formset.is_valid(), formset.errors)
+        formset.save()
+        self.failUnless(self.user.has_perm('view', self.obj))
+        UserShare.objects.all().delete()
+
+class InheritanceTestCase(unittest.TestCase):
+    def setUp(self):
+        # Create nested folders containing a document, users and groups.
+        self.root = TestFolder.objects.create()
+        self.folder = TestFolder.objects.create(parent=self.root)
+        self.document = TestDocument.objects.create(folder=self.folder)
+        self.user = User.objects.create(username='user')
+        self.group = Group.objects.create(name='group')
+        self.group_user = User.objects.create(username='group_user')
+        self.group_user.groups.add(self.group)
+        self.group_user.save()
+    
+    def tearDown(self):
+        # Delete created objects.
+        self.document.delete()
+        self.folder.delete()
+        self.root.delete()
+        self.user.delete()
+        self.group.delete()
+        self.group_user.delete()
+
+    def test_inherited_shares(self):
+        # Nothing is shared without shares.
+        self.failIf(self.user.has_perm('view', self.document))
+        self.failIf(utils.limit_queryset_by_permission(TestDocument.objects.all(), 'view', self.user))
+        
+        # Documents inherit shares from their folder's ancestors.
+        utils.grant_shares([(self.user, self.root), (self.group, self.folder)], can_view=True)
+        self.failUnless(self.user.has_perm('view', self.folder))
+        self.failUnless(self.user.has_perm('view', self.document))
+        self.failIf(self.user.has_perm('change', self.document))
+        self.failUnless(self.group_user.has_perm('view', self.document))
+        self.failIf(self.group_user.has_perm('view', self.root))
+        self.failUnless(self.document in utils.limit_queryset_by_permission(TestDocument.objects.all(), 'view', self.user))
+        self.failUnless(self.document in utils.limit_queryset_by_permission(TestDocument.objects.all(), 'view', self.group_user))
+        self.failUnless(utils.has_perms_for_objects(self.group_user, 'view', [self.document])[self.document])
+        
+        # Inherited shares are resolved in a single query.
+        user = User.objects.get(pk=self.user.pk)
+        self.failUnlessEqual(count_queries(lambda: list(utils.limit_queryset_by_permission(TestDocument.objects.all(), 'view', user))), 1)
+        
+        # Managers limit querysets to shared objects, composing with filters.
+        self.failUnlessEqual(list(TestDocument.objects.visible_to(self.user)), [self.document])
+        self.failUnlessEqual(list(TestDocument.objects.filter(folder=self.folder).visible_to(self.user)), [self.document])
+        self.failIf(TestDocument.objects.visible_to(self.user, 'change'))
+        self.failUnlessEqual(count_queries(lambda: list(TestDocument.objects.select_related('folder').visible_to(
+                user).exclude(pk=0)[:10])), 1)
+        
+        # Users with access and objects users can access are listed.
+        self.failUnlessEqual(set(utils.users_with_perm(self.document, 'view', chunk_size=1)), 
+                set([self.user, self.group_user]))
+        self.failUnlessEqual(list(utils.users_with_perm(self.folder, 'change')), [])
+        self.failUnlessEqual(list(utils.objects_for_user(self.user, 'view', chunk_size=1)), 
+                [self.document, self.root, self.folder])
+        self.failUnlessEqual(list(utils.objects_for_user(self.group_user, 'view')), 
+                [self.document, self.folder])
+        
+        # Revoking ancestor shares revokes inherited access.
+        utils.revoke_shares([(self.user, self.root), (self.group, self.folder)])
+        self.failIf(self.user.has_perm('view', self.document))
+        self.failIf(self.group_user.has_perm('view', self.document))
+
+    def test_inherited_shares_of_filtered_objects(self):
+        # Ancestors are resolved regardless of default manager filters.
+        page = TestPage.objects.create(folder=self.folder)
+        utils.grant_shares([(self.user, self.root)], can_view=True)
+        self.failUnless(self.user.has_perm('view', page))
+        self.failUnlessEqual(list(utils.users_with_perm(page, 'view')), [self.user])
+        utils.revoke_shares([(self.user, self.root)])
+        page.delete()
@@ -1,14 +1,626 @@
+from __future__ import with_statement
+
+import itertools
+import operator
+from datetime import datetime
+from functools import reduce
+
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, F, Q
+from django.utils.encoding import smart_unicode
+
+from sharing import cache, effective, registry, stats
+from sharing.models import SCOPE_CHOICES, SHARE_FIELDS, EffectiveShare, GroupShare, ScopeShare, \
+        UserShare, bulk_changes, deferred_share_cleanup, get_content_type_object_field, get_object_field, \
+        get_object_key, get_scopes, get_valid_lookup
+from sharing.registry import get_content_type, get_share_field
+
+def has_perms_for_objects(user, perm, objs):
+    """
+    Bulk version of user.has_perm(perm, obj), returning a dict mapping each of 
+    the given objects to whether or not the user has the given permission. 
+    Backends providing has_perms_for_objects check all objects at once, other 
+    backends are consulted per object.
+    """
+    from django.contrib.auth import get_backends
+
+    objs = list(objs)
+
+    # Active superusers have all permissions.
+    if user.is_active and user.is_superuser:
+        return dict([(obj, True) for obj in objs])
+
+    perms = dict([(obj, False) for obj in objs])
+
+    # Inactive users have no permissions.
+    if user.is_authenticated() and not user.is_active:
+        return perms
+
+    for backend in get_backends():
+        if not getattr(backend, 'supports_object_permissions', False):
+            continue
+        if user.is_anonymous() and not getattr(backend, 'supports_anonymous_user', False):
+            continue
+        remaining = [obj for obj in objs if not perms[obj]]
+        if not remaining:
+            break
+        if hasattr(backend, 'has_perms_for_objects'):
+            for obj, granted in backend.has_perms_for_objects(user, perm, remaining).items():
+                perms[obj] = perms[obj] or granted
+        elif hasattr(backend, 'has_perm'):
+            for obj in remaining:
+                perms[obj] = backend.has_perm(user, perm, obj)
+    return perms
+
+def get_shared_keys(model, user, field):
+    """
+    Returns querysets of primary keys of objects of the given model shared 
+    directly with the given user, her groups or the scopes she belongs to with
+    the given share field or custom verb, for use as subqueries. Only shares 
+    currently valid are included.
+    """
+    if field not in SHARE_FIELDS and field not in registry.get_verbs(model):
+        return []
+    filters = {
+        'content_type': get_content_type(model),
+    }
+    valid = get_valid_lookup()
+    object_field = get_object_field(model)
+    querysets = [
+        ScopeShare.objects.filter(valid, scope__in=get_scopes(user), **filters),
+    ]
+    if user.is_authenticated() and effective.is_enabled():
+        querysets.append(EffectiveShare.objects.filter(valid, user=user, **filters))
+    elif user.is_authenticated():
+        querysets.extend([
+            UserShare.objects.filter(valid, user=user, **filters),
+            GroupShare.objects.filter(valid, group__in=user.groups.all(), **filters),
+        ])
+    return [_filter_granted(qs, model, field).values(object_field) for qs in querysets]
+
+def _filter_granted(qs, model, field):
+    """
+    Filter the given share queryset by the given share field or custom verb of
+    the given model, the latter with a masked comparison.
+    """
+    if field in SHARE_FIELDS:
+        return qs.filter(**{field: True})
+
+    # Clearing granted bits lowers the bitmask.
+    permissions = F('permissions')
+    mask = ~registry.get_verb_mask(model, [field])
+    if hasattr(permissions, 'bitand'):
+        # Django 1.5 and up.
+        cleared = permissions.bitand(mask)
+    else:
+        cleared = permissions & mask
+    return qs.filter(permissions__gt=cleared)
+
+def get_inherited_lookups(model, user, field):
+    """
+    Returns Q objects matching objects of the given model inheriting the given
+    share field from ancestors shared with the given user or her groups, as 
+    declared with sharing.registry.inherit. Ancestors are resolved by joins.
+    """
+    lookups = []
+    for path, ancestor_model in registry.get_ancestor_paths(model):
+        for keys in get_shared_keys(ancestor_model, user, field):
+            lookups.append(Q(**{'%s__in' % path: keys}))
+    return lookups
+
 def limit_queryset_by_permission(qs, perm, user):
     """
     Filter queryset by user permission.
+
+    Shares are resolved through user and group share subqueries, so the
+    resulting queryset remains lazy and is evaluated as a single query.
+    """
+    # Active superusers have all permissions.
+    if user.is_active and user.is_superuser:
+        return qs
+
+    lookups = []
+
+    # User always has access to herself.
+    if isinstance(user, qs.model):
+        lookups.append(Q(pk=user.pk))
+
+    # Inactive users have no permissions, anonymous users only public ones.
+    field = get_share_field(perm, qs.model)
+    if (user.is_active or not user.is_authenticated()) and field is not None:
+        lookups.extend([Q(pk__in=keys) for keys in get_shared_keys(qs.model, user, field)])
+        lookups.extend(get_inherited_lookups(qs.model, user, field))
+
+    if lookups:
+        qs = qs.filter(reduce(operator.or_, lookups))
+    else:
+        qs = qs.none()
+    # Filtering is lazy, its cost is only known once evaluated.
+    stats.report_deferred(None, 'limit_queryset_by_permission', perm, get_content_type(qs.model))
+    return qs
+
+def limit_queryset_by_share(qs, principal, perms=('view',)):
+    """
+    Filter queryset to objects shared directly with the given principal, a 
+    user, group or scope name, by a currently valid share granting all of the 
+    given permissions. Unlike limit_queryset_by_permission a user's group, 
+    scope and inherited shares are not included, so the filter narrows 
+    querysets down by how access was granted. Shares are resolved as a single 
+    subquery.
+    """
+    share_model, principal_id = _get_principal(principal)
+    shares = share_model.objects.filter(get_valid_lookup(), **{
+        'content_type': get_content_type(qs.model),
+        PRINCIPAL_FIELDS[share_model][0]: principal_id,
+    })
+    for perm in perms:
+        field = get_share_field(perm, qs.model)
+        if field is None or (field not in SHARE_FIELDS and field not in registry.get_verbs(qs.model)):
+            return qs.none()
+        shares = _filter_granted(shares, qs.model, field)
+    return qs.filter(pk__in=shares.values(get_object_field(qs.model)))
+
+def get_share_principals(user, objs, perm='view'):
+    """
+    Returns a dict mapping each of the given objects to the principals 
+    sharing it with the given user with the given permission by currently 
+    valid shares, being the user herself, her groups and scope names in that
+    order. Inherited shares are not included. Shares are resolved with one 
+    query per share model and content type.
+    """
+    principals = dict([(obj, []) for obj in objs])
+    objects = {}
+    for obj in principals:
+        objects.setdefault(get_content_type(obj), {})[get_object_key(obj)] = obj
+
+    valid = get_valid_lookup()
+    for content_type, keys in objects.items():
+        model = content_type.model_class()
+        field = get_share_field(perm, model)
+        if field is None or (field not in SHARE_FIELDS and field not in registry.get_verbs(model)):
+            continue
+        filters = {
+            'content_type': content_type,
+            '%s__in' % get_object_field(model): keys.keys(),
+        }
+        querysets = []
+        if user.is_authenticated():
+            querysets.extend([
+                (UserShare.objects.filter(valid, user=user, **filters), lambda share: user),
+                (GroupShare.objects.filter(valid, group__in=user.groups.all(), **filters).select_related(
+                        'group').order_by('group__name'), lambda share: share.group),
+            ])
+        querysets.append((ScopeShare.objects.filter(valid, scope__in=get_scopes(user), **filters), 
+                lambda share: share.scope))
+        for qs, get_principal in querysets:
+            for share in _filter_granted(qs, model, field):
+                principals[keys[share.get_object_key()]].append(get_principal(share))
+    return principals
+
+def users_with_perm(obj, perm, chunk_size=1000):
+    """
+    Yields active users with the given permission for the given object through
+    their own, group, scope or inherited shares, resolved by share subqueries
+    and fetched in chunks of the given size. Superusers only have permissions
+    shared with them included.
+    """
+    model = obj.__class__
+    field = get_share_field(perm, model)
+    if field is None:
+        return
+
+    # Resolve ancestors the object inherits shares from in a single query.
+    targets = [(model, get_object_key(obj))]
+    paths = registry.get_ancestor_paths(model)
+    if paths:
+        ancestor_keys = list(model._base_manager.filter(pk=obj.pk).values_list(*[path for path, ancestor_model in paths]))
+        for (path, ancestor_model), key in zip(paths, ancestor_keys and ancestor_keys[0] or ()):
+            if key is not None:
+                targets.append((ancestor_model, get_object_key(ancestor_model(pk=key))))
+
+    lookups = []
+    valid = get_valid_lookup()
+    for target_model, key in targets:
+        if field not in SHARE_FIELDS and field not in registry.get_verbs(target_model):
+            continue
+        filters = {
+            'content_type': get_content_type(target_model),
+            get_object_field(target_model): key,
+        }
+
+        # Scope shares grant all users access.
+        shares = ScopeShare.objects.filter(valid, **filters)
+        if _filter_granted(shares, target_model, field).exists():
+            lookups = [Q()]
+            break
+
+        if effective.is_enabled():
+            shares = EffectiveShare.objects.filter(valid, **filters)
+            lookups.append(Q(pk__in=_filter_granted(shares, target_model, field).values('user')))
+        else:
+            shares = UserShare.objects.filter(valid, **filters)
+            lookups.append(Q(pk__in=_filter_granted(shares, target_model, field).values('user')))
+            shares = GroupShare.objects.filter(valid, **filters)
+            lookups.append(Q(pk__in=User.groups.through.objects.filter(
+                group__in=_filter_granted(shares, target_model, field).values('group'),
+            ).values('user')))
+
+    users = User.objects.filter(reduce(operator.or_, lookups), is_active=True)
+    for user in _iterate_chunked(users, chunk_size):
+        yield user
+
+def objects_for_user(user, perm='view', chunk_size=1000):
+    """
+    Yields objects of any model the given user has the given permission for,
+    model by model, each model's objects being fetched through 
+    limit_queryset_by_permission in chunks of the given size. Only models
+    shared with the user, her groups or her scopes, or inheriting shares from
+    them, are included.
+    """
+    querysets = [ScopeShare.objects.filter(scope__in=get_scopes(user))]
+    if user.is_authenticated() and effective.is_enabled():
+        querysets.append(EffectiveShare.objects.filter(user=user))
+    elif user.is_authenticated():
+        querysets.extend([
+            UserShare.objects.filter(user=user),
+            GroupShare.objects.filter(group__in=user.groups.all()),
+        ])
+    models = set()
+    for qs in querysets:
+        for content_type_id in qs.order_by().values_list('content_type', flat=True).distinct():
+            models.add(ContentType.objects.get_for_id(content_type_id).model_class())
+    models.discard(None)
+    for model in registry.get_inheriting_models():
+        if [ancestor_model for path, ancestor_model in registry.get_ancestor_paths(model) if ancestor_model in models]:
+            models.add(model)
+
+    models = sorted(models, key=lambda model: (model._meta.app_label, model._meta.object_name))
+    for model in models:
+        qs = limit_queryset_by_permission(model._default_manager.all(), perm, user)
+        for obj in _iterate_chunked(qs, chunk_size):
+            yield obj
+
+def _iterate_chunked(qs, chunk_size):
+    """
+    Yields objects of the given queryset in chunks of the given size, 
+    paginating by primary key so each chunk is a bounded, indexed query 
+    regardless of how far iteration progressed.
+    """
+    qs = qs.order_by('pk')
+    last_pk = None
+    while True:
+        if last_pk is None:
+            chunk = list(qs[:chunk_size])
+        else:
+            chunk = list(qs.filter(pk__gt=last_pk)[:chunk_size])
+        for obj in chunk:
+            yield obj
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+def merge_duplicate_shares(share_model, principal_field, dry_run=False):
+    """
+    Merge shares of the given share model sharing the same object with the same
+    principal into the earliest share, granting it the union of the duplicates'
+    permissions. Returns the number of duplicate shares removed.
     """
-    # TODO: There must be a more efficient way to do this, refactor.
-    filtered_object_ids = []
-    for obj in qs:
-        # User always has access to herself.
-        if obj == user:
-            filtered_object_ids.append(obj.id)
+    fields = (principal_field, 'content_type', 'object_id', 'object_pk')
+    duplicates = share_model.objects.values(*fields).annotate(
+        num_shares=Count('id'),
+    ).filter(num_shares__gt=1).order_by()
+
+    removed = 0
+    for duplicate in duplicates:
+        shares = list(share_model.objects.filter(
+            **dict([(field, duplicate[field]) for field in fields])
+        ).order_by('id'))
+        removed += len(shares) - 1
+        if dry_run:
             continue
-        if user.has_perm(perm, obj):
-            filtered_object_ids.append(obj.id)
-    return qs.filter(id__in=filtered_object_ids)
+        share = shares[0]
+        for field in SHARE_FIELDS:
+            setattr(share, field, True in [getattr(s, field) for s in shares])
+        share_model.objects.filter(pk__in=[s.pk for s in shares[1:]]).delete()
+        share.save()
+    return removed
+
+# Maps share models to the lookup and attribute names of their principal.
+PRINCIPAL_FIELDS = {
+    GroupShare: ('group', 'group_id'),
+    ScopeShare: ('scope', 'scope'),
+    UserShare: ('user', 'user_id'),
+}
+
+def _get_principal(principal):
+    """
+    Returns the share model and principal id of the given user, group or scope
+    name.
+    """
+    if isinstance(principal, basestring):
+        if principal not in dict(SCOPE_CHOICES):
+            raise ValueError("Unknown share scope '%s'." % principal)
+        return ScopeShare, principal
+    return isinstance(principal, Group) and GroupShare or UserShare, principal.pk
+
+def _share_batches(shares, batch_size):
+    """
+    Yields batches of (principal, object) pairs of at most the given size as 
+    dicts mapping (share model, content type id) keys to sets of 
+    (principal id, object key) pairs, object keys being primary keys as 
+    returned by get_object_key. Scope principals are given by name, i.e. 
+    'public', and identified by it.
+    """
+    shares = iter(shares)
+    while True:
+        batch = {}
+        for principal, obj in itertools.islice(shares, batch_size):
+            share_model, principal_id = _get_principal(principal)
+            content_type = get_content_type(obj)
+            batch.setdefault((share_model, content_type.id), set()).add((principal_id, get_object_key(obj)))
+        if not batch:
+            return
+        yield batch
+
+def _existing_shares(share_model, content_type_id, pairs):
+    """
+    Returns existing shares of the given model and content type for the given 
+    (principal id, object key) pairs.
+    """
+    principal_lookup, principal_attname = PRINCIPAL_FIELDS[share_model]
+    object_field = get_content_type_object_field(content_type_id)
+    candidates = share_model.objects.filter(**{
+        'content_type': content_type_id,
+        '%s__in' % object_field: set([object_key for principal_id, object_key in pairs]),
+        '%s__in' % principal_lookup: set([principal_id for principal_id, object_key in pairs]),
+    })
+    return [share for share in candidates if \
+            (getattr(share, principal_attname), share.get_object_key()) in pairs]
+
+def _shares_changed(share_model, content_type_id, pairs):
+    """
+    Invalidate caches and refresh effective shares after bulk share changes.
+    """
+    principal_ids = set([principal_id for principal_id, object_key in pairs])
+    if share_model is ScopeShare:
+        # Scope shares are not reflected by effective shares.
+        cache.invalidate(scopes=True)
+        return
+    elif share_model is GroupShare:
+        cache.invalidate(group_ids=principal_ids)
+        user_ids = User.groups.through.objects.filter(
+            group__in=principal_ids,
+        ).values_list('user', flat=True)
+    else:
+        cache.invalidate(user_ids=principal_ids)
+        user_ids = principal_ids
+
+    if effective.is_enabled():
+        effective.refresh_objects(
+            content_type_id,
+            set([object_key for principal_id, object_key in pairs]),
+            user_ids,
+        )
+
+@cache.commit_on_success
+def grant_shares(shares, can_view=False, can_change=False, can_delete=False, batch_size=500, verbs=(),
+        valid_from=None, valid_until=None):
+    """
+    Grant the given permissions and custom verbs for many (principal, object) 
+    pairs at once, where principals are users, groups or scope names, i.e.
+    'public' or 'authenticated'. Shares are valid within the given window, 
+    indefinitely by default, replacing windows of existing shares so expired
+    shares are granted again. Existing shares are updated, missing shares 
+    created in bulk and duplicate pairs skipped. Pairs are consumed in batches
+    of the given size within a single transaction, so large iterables can be 
+    streamed. Returns the number of shares created.
+    """
+    perms = dict([(field, True) for field, value in zip(SHARE_FIELDS, (can_view, can_change, can_delete)) if value])
+    created = 0
+    with bulk_changes():
+        for batch in _share_batches(shares, batch_size):
+            for (share_model, content_type_id), pairs in batch.items():
+                principal_field = PRINCIPAL_FIELDS[share_model][1]
+                object_field = get_content_type_object_field(content_type_id)
+                mask = _get_verb_mask(content_type_id, verbs)
+                existing = _existing_shares(share_model, content_type_id, pairs)
+                if perms:
+                    share_model.objects.filter(pk__in=[share.pk for share in existing if \
+                            [field for field in perms if not getattr(share, field)]]).update(**perms)
+                _update_permissions(share_model, existing, lambda permissions: permissions | mask)
+                share_model.objects.filter(pk__in=[share.pk for share in existing if \
+                        (share.valid_from, share.valid_until) != (valid_from, valid_until)]).update(
+                        valid_from=valid_from, valid_until=valid_until)
+
+                missing = pairs - set([(getattr(share, principal_field), share.get_object_key()) for share in existing])
+                new_shares = [share_model(**dict(perms, **{
+                    principal_field: principal_id,
+                    'content_type_id': content_type_id,
+                    object_field: object_key,
+                    'permissions': mask,
+                    'valid_from': valid_from,
+                    'valid_until': valid_until,
+                })) for principal_id, object_key in missing]
+
+                # Insert in bulk where supported, i.e. Django 1.4 and up.
+                if hasattr(share_model.objects, 'bulk_create'):
+                    share_model.objects.bulk_create(new_shares)
+                else:
+                    for share in new_shares:
+                        share.save(force_insert=True)
+                created += len(new_shares)
+
+                _shares_changed(share_model, content_type_id, pairs)
+    return created
+
+@cache.commit_on_success
+def revoke_shares(shares, can_view=False, can_change=False, can_delete=False, batch_size=500, verbs=()):
+    """
+    Revoke the given permissions and custom verbs for many (principal, object)
+    pairs at once, where principals are users, groups or scope names, revoking
+    all permissions and verbs if none are given. Shares left without 
+    permissions are deleted. Pairs are consumed in batches of the given size within a 
+    single transaction, so large iterables can be streamed. Returns the number
+    of shares deleted.
+    """
+    perms = dict([(field, False) for field, value in zip(SHARE_FIELDS, (can_view, can_change, can_delete)) if value])
+    revoke_all = not perms and not verbs
+    if revoke_all:
+        perms = dict([(field, False) for field in SHARE_FIELDS])
+    deleted = 0
+    with bulk_changes():
+        for batch in _share_batches(shares, batch_size):
+            for (share_model, content_type_id), pairs in batch.items():
+                existing = _existing_shares(share_model, content_type_id, pairs)
+                if not existing:
+                    continue
+                if perms:
+                    share_model.objects.filter(pk__in=[share.pk for share in existing]).update(**perms)
+                if revoke_all:
+                    _update_permissions(share_model, existing, lambda permissions: 0)
+                else:
+                    mask = _get_verb_mask(content_type_id, verbs)
+                    _update_permissions(share_model, existing, lambda permissions: permissions & ~mask)
+
+                # Delete shares left without permissions.
+                empty = share_model.objects.filter(
+                    pk__in=[share.pk for share in existing],
+                    permissions=0,
+                    **dict([(field, False) for field in SHARE_FIELDS])
+                )
+                deleted += empty.count()
+                empty.delete()
+
+                _shares_changed(share_model, content_type_id, pairs)
+    return deleted
+
+def _get_verb_mask(content_type_id, verbs):
+    if not verbs:
+        return 0
+    return registry.get_verb_mask(ContentType.objects.get_for_id(content_type_id).model_class(), verbs)
+
+def _update_permissions(share_model, shares, update):
+    """
+    Update the permissions bitmask of the given shares by the given function,
+    with one query per distinct resulting bitmask.
+    """
+    changed = {}
+    for share in shares:
+        permissions = update(share.permissions)
+        if permissions != share.permissions:
+            changed.setdefault(permissions, []).append(share.pk)
+    for permissions, pks in changed.items():
+        share_model.objects.filter(pk__in=pks).update(permissions=permissions)
+
+def purge_expired_shares(share_model, batch_size=500, now=None):
+    """
+    Delete shares of the given share model expired at the given time, 
+    defaulting to now, in batches of the given size. Each batch is committed
+    in its own transaction, so rows are only locked briefly. Expired shares
+    grant nothing, so caches and effective shares are left as is. Returns the
+    number of shares deleted.
+    """
+    now = now or datetime.now()
+    deleted = 0
+    while True:
+        ids = list(share_model.objects.filter(valid_until__lte=now).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        _delete_shares(share_model, ids)
+        deleted += len(ids)
+
+@cache.commit_on_success
+def _delete_shares(share_model, ids):
+    with bulk_changes():
+        share_model.objects.filter(pk__in=ids).delete()
+
+def delete_object_shares(model, keys, batch_size=500):
+    """
+    Delete shares of objects of the given model with the given primary keys,
+    i.e. once the objects are deleted, with a query per share model and batch
+    of keys of the given size rather than per share. Caches of the affected
+    users, groups and scopes are invalidated. Returns the number of shares 
+    deleted.
+    """
+    filters = {
+        'content_type': get_content_type(model),
+    }
+    object_field = get_object_field(model)
+    share_models = [UserShare, GroupShare, ScopeShare]
+    if effective.is_enabled():
+        share_models.append(EffectiveShare)
+
+    keys = iter(keys)
+    deleted = 0
+    with bulk_changes():
+        while True:
+            batch = list(itertools.islice(keys, batch_size))
+            if not batch:
+                return deleted
+            if object_field == 'object_pk':
+                batch = [smart_unicode(key) for key in batch]
+            filters['%s__in' % object_field] = batch
+            for share_model in share_models:
+                rows = list(share_model.objects.filter(**filters).values_list('id', _get_principal_lookup(share_model)))
+                if rows:
+                    share_model.objects.filter(pk__in=[share_id for share_id, principal_id in rows]).delete()
+                    _invalidate_principals(share_model, [principal_id for share_id, principal_id in rows])
+                    deleted += len(rows)
+
+def delete_queryset(qs, batch_size=500):
+    """
+    Delete the objects of the given queryset along with their shares and the 
+    shares of objects deleted through cascades, deleting shares in bulk once 
+    all objects are deleted rather than per object. Returns the number of 
+    shares deleted.
+    """
+    with deferred_share_cleanup(batch_size) as deleted:
+        qs.delete()
+    return sum(deleted.values())
+
+def purge_orphaned_shares(share_model, content_type_id, batch_size=500, after_id=0):
+    """
+    Delete shares of the given share model and content type whose objects no
+    longer exist, checking shares in batches of the given size in order of 
+    their ids, starting after the given share id. Each batch is committed in
+    its own transaction. Yields (last checked share id, number of shares 
+    deleted) per batch, so progress can be reported and resumed.
+    """
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    object_field = get_content_type_object_field(content_type_id)
+    shares = share_model.objects.filter(content_type=content_type_id).order_by('id')
+    while True:
+        rows = list(shares.filter(id__gt=after_id).values_list('id', object_field, 
+                _get_principal_lookup(share_model))[:batch_size])
+        if not rows:
+            return
+
+        # Shares of removed models are all orphaned.
+        existing = set()
+        if model is not None:
+            keys = set([key for share_id, key, principal_id in rows if key is not None])
+            existing = set([smart_unicode(pk) for pk in \
+                    model._base_manager.filter(pk__in=keys).values_list('pk', flat=True)])
+        orphans = [(share_id, principal_id) for share_id, key, principal_id in rows \
+                if key is None or smart_unicode(key) not in existing]
+        if orphans:
+            _delete_shares(share_model, [share_id for share_id, principal_id in orphans])
+            _invalidate_principals(share_model, [principal_id for share_id, principal_id in orphans])
+        after_id = rows[-1][0]
+        yield after_id, len(orphans)
+
+def _get_principal_lookup(share_model):
+    return PRINCIPAL_FIELDS.get(share_model, ('user',))[0]
+
+def _invalidate_principals(share_model, principal_ids):
+    """
+    Invalidate caches of the given principals of deleted shares of the given
+    share model.
+    """
+    if share_model is ScopeShare:
+        cache.invalidate(scopes=True)
+    elif share_model is GroupShare:
+        cache.invalidate(group_ids=set(principal_ids))
+    else:
+        cache.invalidate(user_ids=set(principal_ids))